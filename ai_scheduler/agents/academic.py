@@ -1,35 +1,19 @@
-import json
+import orjson
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.messages import ToolMessage
 from models import MultiAgentState, GPAStrategyOutput
-from llm_config import chat_llm
+from llm_config import get_llm, stream_invoke, content_to_str
 from database import db_manager
+from utils import (
+    get_current_date, list_available_courses, enroll_student_in_course, 
+    unenroll_student_from_course, get_my_enrolled_courses, retrieve_from_docs
+)
 
-def academic_agent(state: MultiAgentState) -> dict:
-    """
-    Academic Strategist Agent: Handles CGPA/GPA calculations, history management,
-    course enrollment, and grade path optimization.
-    """
-    query = state.get("user_query", "")
-    current_state = state.get("current_state") or {}
-    
-    # Fetch latest history from Database
-    db_history = db_manager.get_full_academic_history(user_id=1)
-    academic_history = db_history.model_dump()
-
-    # Define tools and bind them to the LLM
-    from utils import (
-        get_current_date, list_available_courses, enroll_student_in_course, 
-        unenroll_student_from_course, get_my_enrolled_courses, retrieve_from_docs
-    )
-    tools = [
-        get_current_date, list_available_courses, enroll_student_in_course, 
-        unenroll_student_from_course, get_my_enrolled_courses, retrieve_from_docs
-    ]
-    chat_llm_with_tools = chat_llm.bind_tools(tools)
-    
-    # SYSTEM PROMPT
-    system_prompt_text = """You are an Academic Execution Agent. Your job is to MANAGE student enrollments and academic planning.
+# SYSTEM PROMPT
+_ACADEMIC_SYSTEM_PROMPT = """You are an Academic Execution Agent. Your job is to MANAGE student enrollments and academic planning.
 
 Today's Date Context: You can use the 'get_current_date' tool to resolve current vs past semesters.
 
@@ -39,63 +23,90 @@ CRITICAL RULES:
 3. Use 'list_available_courses' for "what can I take?", "available courses", "catalog".
 4. If you need to verify if a course exists before enrolling, you can call 'enroll_student_in_course' with the 'course_name' directly; the tool handles the lookup for you.
 
-DO NOT tell the user to "Log into the student portal" or "Search for the course manually". YOU ARE THE PORTAL. Perform the action using your tools.
+DO NOT tell the user to "Log into the student portal" or "Search for the course manually". YOU ARE THE PORTAL. Perform the action using your tools."""
 
-Current Academic History:
+# Per-request state goes in its own trailing message so the static rules above
+# remain a stable prefix for provider-side prompt caching.
+_ACADEMIC_STATE_PROMPT = """Current Academic History:
 {history}
 
 Current Semester Info:
 {active_courses}"""
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt_text),
-        ("human", "{query}")
-    ])
+_ACADEMIC_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _ACADEMIC_SYSTEM_PROMPT),
+    ("system", _ACADEMIC_STATE_PROMPT),
+    ("human", "{query}")
+])
+
+_TOOL_MAP = {
+    "get_current_date": get_current_date,
+    "list_available_courses": list_available_courses,
+    "enroll_student_in_course": enroll_student_in_course,
+    "unenroll_student_from_course": unenroll_student_from_course,
+    "get_my_enrolled_courses": get_my_enrolled_courses,
+    "retrieve_from_docs": retrieve_from_docs
+}
+_TOOLS_LIST = list(_TOOL_MAP.values())
+
+@lru_cache(maxsize=1)
+def _get_academic_llm():
+    """The base model with the academic tools bound, built on the first academic request."""
+    return get_llm().bind_tools(_TOOLS_LIST)
+
+@lru_cache(maxsize=8)
+def _serialize_history(user_id: int, history_version: int) -> str:
+    """Serialized academic history, recomputed only when db_manager reports a write."""
+    return db_manager.get_full_academic_history(user_id=user_id).model_dump_json()
+
+def academic_agent(state: MultiAgentState) -> dict:
+    """
+    Academic Strategist Agent: Handles CGPA/GPA calculations, history management,
+    course enrollment, and grade path optimization.
+    """
+    query = state.get("user_query", "")
+    current_state = state.get("current_state") or {}
     
     try:
-        history_str = json.dumps(academic_history)
-        active_courses = json.dumps(current_state.get("active_tasks", []))
+        # Fetch latest history from Database (memoized per write version)
+        history_str = _serialize_history(1, db_manager.academic_version)
+        active_courses = orjson.dumps(current_state.get("active_tasks", [])).decode()
         
         # 1. First Pass: Allow agent to call tools
-        response = chat_llm_with_tools.invoke(prompt.format(
+        response = stream_invoke(_get_academic_llm(), _ACADEMIC_PROMPT.format(
             history=history_str,
             active_courses=active_courses,
             query=query
         ))
         
         # 2. Process Tools (Loop for multi-step if needed)
-        tool_map = {
-            "get_current_date": get_current_date,
-            "list_available_courses": list_available_courses,
-            "enroll_student_in_course": enroll_student_in_course,
-            "unenroll_student_from_course": unenroll_student_from_course,
-            "get_my_enrolled_courses": get_my_enrolled_courses,
-            "retrieve_from_docs": retrieve_from_docs
-        }
+        # Rendered once; history and active courses don't change within the loop
+        rendered_state = _ACADEMIC_STATE_PROMPT.format(history=history_str, active_courses=active_courses)
         
         iteration = 0
         while hasattr(response, "tool_calls") and response.tool_calls and iteration < 3:
             iteration += 1
-            tool_outputs = []
             
             # Use Tool Messages for LangChain consistency
-            from langchain_core.messages import ToolMessage
             messages = [
-                ("system", system_prompt_text.format(history=history_str, active_courses=active_courses)),
+                ("system", _ACADEMIC_SYSTEM_PROMPT),
+                ("system", rendered_state),
                 ("human", query),
                 response
             ]
             
-            for tool_call in response.tool_calls:
-                tool_func = tool_map.get(tool_call["name"])
-                if tool_func:
-                    tool_res = tool_func.invoke(tool_call["args"])
-                    messages.append(ToolMessage(content=str(tool_res), tool_call_id=tool_call["id"]))
+            # Tools are independent DB/IO lookups, so run them concurrently
+            known_calls = [tc for tc in response.tool_calls if tc["name"] in _TOOL_MAP]
+            if known_calls:
+                with ThreadPoolExecutor(max_workers=len(known_calls)) as executor:
+                    futures = [executor.submit(_TOOL_MAP[tc["name"]].invoke, tc["args"]) for tc in known_calls]
+                    for tool_call, future in zip(known_calls, futures):
+                        messages.append(ToolMessage(content=str(future.result()), tool_call_id=tool_call["id"]))
             
             # Get next response (might call more tools or final answer)
-            response = chat_llm_with_tools.invoke(messages)
+            response = stream_invoke(_get_academic_llm(), messages)
 
-        content = response.content if isinstance(response.content, str) else str(response.content)
+        content = content_to_str(response.content)
         
         return {"academic_output": {"response": content, "raw_content": content}}
         
@@ -1,8 +1,34 @@
+import orjson
+import datetime
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage, AIMessage
+from pydantic import ValidationError
 from models import MultiAgentState, ChatOutput
-from llm_config import chat_llm
+from llm_config import get_llm, stream_invoke, content_to_str, extract_json
+
+_CHAT_PARSER = PydanticOutputParser(pydantic_object=ChatOutput)
+_CHAT_FORMAT_INSTRUCTIONS = _CHAT_PARSER.get_format_instructions()
+
+_CHAT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a helpful academic scheduling assistant. Be friendly, concise, and helpful.
+
+You can help with:
+- Scheduling study sessions and events
+- Analyzing syllabus documents
+- Managing calendar
+- General academic questions
+
+{rag_context}
+
+Today's Date: {today} ({day_name})
+
+Conversation History:
+{history}
+
+{format_instructions}"""),
+    ("human", "{query}")
+])
 
 def chat_agent(state: MultiAgentState) -> dict:
     """
@@ -12,7 +38,6 @@ def chat_agent(state: MultiAgentState) -> dict:
     query = state.get("user_query", "")
     messages = state.get("messages", [])
     
-    parser = PydanticOutputParser(pydantic_object=ChatOutput)
     rag_output = state.get("rag_output") or {}
     
     # Extract context from RAG if available
@@ -21,68 +46,38 @@ def chat_agent(state: MultiAgentState) -> dict:
         rag_context = f"""
 Information extracted from uploaded documents:
 - Content: {rag_output.get('synthesized_answer', 'N/A')}
-- Specific Deadlines: {json.dumps(rag_output.get('extracted_deadlines', []))}
-- Timetable: {json.dumps(rag_output.get('extracted_timetable', []))}
+- Specific Deadlines: {rag_output.get('_deadlines_json') or orjson.dumps(rag_output.get('extracted_deadlines', [])).decode()}
+- Timetable: {rag_output.get('_timetable_json') or orjson.dumps(rag_output.get('extracted_timetable', [])).decode()}
 """
     
     # Build conversation context
-    conv_history = ""
+    history_lines = []
     for msg in messages[-5:]:  # Last 5 messages for context
         if isinstance(msg, HumanMessage):
-            conv_history += f"User: {msg.content}\n"
+            history_lines.append(f"User: {msg.content}\n")
         elif isinstance(msg, AIMessage):
-            conv_history += f"Assistant: {msg.content}\n"
+            history_lines.append(f"Assistant: {msg.content}\n")
+    conv_history = "".join(history_lines)
     
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a helpful academic scheduling assistant. Be friendly, concise, and helpful.
-
-You can help with:
-- Scheduling study sessions and events
-- Analyzing syllabus documents
-- Managing calendar
-- General academic questions
-
-{rag_context}
-
-Today's Date Context: You can use the 'get_current_date' tool to provide the exact date if the user asks.
-
-Conversation History:
-{history}
-
-{format_instructions}"""),
-        ("human", "{query}")
-    ])
+    # Resolve the date locally instead of round-tripping through a tool call
+    today_now = datetime.datetime.now()
     
     try:
-        # Initial invocation
-        response = chat_llm.invoke(prompt.format(
+        response = stream_invoke(get_llm(), _CHAT_PROMPT.format(
             query=query,
+            today=today_now.strftime("%Y-%m-%d"),
+            day_name=today_now.strftime("%A"),
             history=conv_history,
             rag_context=rag_context,
-            format_instructions=parser.get_format_instructions()
+            format_instructions=_CHAT_FORMAT_INSTRUCTIONS
         ))
         
-        # Check for tool calls
-        if hasattr(response, "tool_calls") and response.tool_calls:
-            from utils import get_current_date
-            tool_outputs = []
-            for tool_call in response.tool_calls:
-                if tool_call["name"] == "get_current_date":
-                    date_res = get_current_date.invoke(tool_call["args"])
-                    tool_outputs.append(date_res)
-            
-            # Re-invoke with confirmed date context
-            if tool_outputs:
-                response = chat_llm.invoke(prompt.format(
-                    query=f"{query} (Context: Today is {tool_outputs[0]})",
-                    history=conv_history,
-                    rag_context=rag_context,
-                    format_instructions=parser.get_format_instructions()
-                ))
-
         # Ensure response.content is a string
-        content = response.content if isinstance(response.content, str) else str(response.content)
-        parsed = parser.parse(content)
+        content = content_to_str(response.content)
+        try:
+            parsed = ChatOutput.model_validate_json(extract_json(content))
+        except ValidationError:
+            parsed = _CHAT_PARSER.parse(content)
         return {"chat_output": parsed.model_dump()}
     except Exception as e:
         fallback = ChatOutput(
@@ -1,14 +1,129 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage
+from pydantic import ValidationError
+import re
 import datetime
+from typing import Optional, Tuple
+import numpy as np
 from models import MultiAgentState, OrchestratorOutput, AgentType
-from llm_config import orchestrator_llm
+from semantic_cache import SemanticLRU, normalize_query, unit_embedding
+from llm_config import get_llm, content_to_str, extract_json
+
+
+# High-precision routing rules; the LLM is only consulted when none of these fire
+_DELETE_RE = re.compile(r"\b(delete|clear|remove|wipe|reset|cancel)\b", re.I)
+_MODIFY_RE = re.compile(
+    r"\b(delete|clear|remove|wipe|reset|cancel|reschedule|add|create|book|move|update|plan)\b"
+    r"|^\s*(please\s+)?schedule\b|\bschedule (a|an|the|my|some|all|every|these|them)\b",
+    re.I
+)
+_DOC_RE = re.compile(r"\b(pdfs?|documents?|docs?|syllabus|timetable|files?|slides?|pptx?|uploaded)\b", re.I)
+_RAG_KEYWORDS_RE = re.compile(r"\b(pdfs?|documents?|syllabus|timetable|this file|extract\w*|summari[sz]\w*)\b", re.I)
+_ACADEMIC_RE = re.compile(r"\b(gpa|cgpa|sgpa|grades?|credits?|courses?|semesters?|enrol\w*|unenrol\w*|register\w*)\b", re.I)
+_CALENDAR_RE = re.compile(
+    r"\b(calendar|events?|agenda|schedule|plans?)\b"
+    r"|\bwhat('s| is| do i have)\b.*\b(today|tomorrow|this week|next week)\b",
+    re.I
+)
+_TODO_RE = re.compile(r"\b(to-?dos?|tasks?|checklist)\b", re.I)
+_GREETING_RE = re.compile(r"^\s*(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening))\b[\s!.?]*$", re.I)
+# Salvage patterns for malformed orchestrator JSON, anchored on the keys so reasoning text can't match
+_INTENT_FIELD_RE = re.compile(r'"intent"\s*:\s*"(\w+)"', re.I)
+_REQUIRES_CONTEXT_FIELD_RE = re.compile(r'"requires_context"\s*:\s*true', re.I)
+
+def _route_by_rules(query: str, has_documents: bool = False) -> Optional[Tuple[AgentType, bool]]:
+    """Returns (intent, requires_context) when a routing rule matches, else None."""
+    mentions_docs = bool(_DOC_RE.search(query))
+    modifies = bool(_MODIFY_RE.search(query))
+    
+    # Rule 1: deletions always go to the scheduler, without a RAG lookup
+    if _DELETE_RE.search(query) and not mentions_docs:
+        return AgentType.SCHEDULER, False
+    # Rules 2-4: document questions go to RAG, document-driven planning goes through RAG to the scheduler
+    if mentions_docs:
+        return (AgentType.SCHEDULER, True) if modifies else (AgentType.RAG, True)
+    if has_documents and modifies:
+        return AgentType.SCHEDULER, True
+    if _ACADEMIC_RE.search(query):
+        return AgentType.ACADEMIC, False
+    if modifies:
+        return AgentType.SCHEDULER, False
+    # Rule 5: read-only calendar lookups
+    if _CALENDAR_RE.search(query):
+        return AgentType.CALENDAR, False
+    # Rule 6: to-do lists have no dedicated agent, so reading them is plain chat
+    if _TODO_RE.search(query):
+        return AgentType.CHAT, False
+    if _GREETING_RE.match(query):
+        return AgentType.CHAT, False
+    return None
+
+_ORCH_PARSER = PydanticOutputParser(pydantic_object=OrchestratorOutput)
+_ORCH_FORMAT_INSTRUCTIONS = _ORCH_PARSER.get_format_instructions()
+
+_ORCH_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a fast routing orchestrator. Analyze the user query and determine which agent should handle it.
+
+Today's Date: {today} ({day_name})
+
+Agent Types:
+- rag: Questions about documents, PDFs, syllabi, extracting information/tasks/timetables/events from files. Use this if documents are uploaded.
+- scheduler: Creating, modifying, or DELETING schedule/calendar events based on user requests or extracted document data. Use this for ANY changes to the schedule.
+- calendar: Viewing existing calendar events checking availability, listing what's planned (Read-only operations)
+- academic: GPA calculation, academic history, CGPA targets, grade path optimization, course enrollment management
+- chat: General conversation, greetings, help requests, unclear queries
+
+Rules for Routing:
+1. ANY request to DELETE, CLEAR, REMOVE, or WIPE events MUST be routed to 'scheduler'. Never route deletions to 'calendar'.
+2. If 'pdf_paths' is NOT empty and the query is about scheduling, tasks, or information, YOU MUST route to 'rag' first (or set 'requires_context' to true).
+3. If the user mentions "this file", "the document", "my syllabus", "timetable", or "from the PDF", route to 'rag'.
+4. If the user wants to PLAN/SCHEDULE based on document information, route to 'scheduler' and set 'requires_context' to true (this triggers a RAG lookup first).
+5. Use 'calendar' ONLY for reading existing events already in the database.
+{pdf_hint}
+
+{format_instructions}
+
+Be decisive and quick. Extract key entities (dates, tasks, subjects) from the query. Ensure 'requires_context' is False for simple deletions.
+"""),
+    ("human", "User Query: {query}")
+])
+
+class SemanticRouteCache:
+    """
+    LRU cache of routing decisions keyed on query embeddings, with a TTL.
+    Exact repeats of a normalized query are answered before anything is embedded.
+    """
+
+    def __init__(self, max_size: int = 1024, threshold: float = 0.95, min_confidence: float = 0.7, ttl: float = 600.0):
+        self.min_confidence = min_confidence
+        self._lru = SemanticLRU(max_size, threshold, ttl)  # normalized query -> output dict
+
+    def lookup(self, query: str):
+        """Returns (cached output or None, query vector or None on an exact hit) for the given query."""
+        cached = self._lru.get(normalize_query(query))
+        if cached is not None:
+            return dict(cached), None
+        vec = unit_embedding(query)
+        cached = self._lru.nearest(vec)
+        return (dict(cached) if cached is not None else None), vec
+
+    def store(self, query: str, vec: np.ndarray, output: dict):
+        if output.get("confidence", 0.0) < self.min_confidence:
+            return
+        self._lru.put(normalize_query(query), vec, output)
+
+    def stats(self) -> dict:
+        return self._lru.stats()
+
+
+route_cache = SemanticRouteCache()
 
 def orchestrator_agent(state: MultiAgentState) -> dict:
     """
     Orchestrator Agent: Routes queries to appropriate agents.
-    Uses a fast, small LLM for low latency.
+    Keyword rules handle common queries; the semantic cache and then the LLM
+    are only consulted when no rule matches.
     """
     user_query = state.get("user_query", "")
     if not user_query and state.get("messages"):
@@ -24,110 +139,104 @@ def orchestrator_agent(state: MultiAgentState) -> dict:
     else:
         user_query = str(user_query)
     
-    parser = PydanticOutputParser(pydantic_object=OrchestratorOutput)
-    
     # Check if PDFs are provided - if so, prioritize RAG routing
     pdf_paths = state.get("pdf_paths", [])
     pdf_hint = ""
     if pdf_paths:
         pdf_hint = f"\n\nIMPORTANT: The user has uploaded documents ({len(pdf_paths)} files). If their query relates to extracting information from a document, route to 'rag'."
     
+    # Fast path: documents attached and the query is plainly about reading them
+    if pdf_paths and _RAG_KEYWORDS_RE.search(user_query) and not _MODIFY_RE.search(user_query):
+        fast = OrchestratorOutput.model_construct(
+            intent=AgentType.RAG.value,
+            confidence=0.95,
+            query_summary=user_query,
+            requires_context=True,
+            reasoning="PDF+RAG-keyword fast path"
+        )
+        return {"orchestrator_output": fast.model_dump(mode="json"), "user_query": user_query}
+    
+    rule_match = _route_by_rules(user_query, has_documents=bool(pdf_paths))
+    if rule_match:
+        intent, requires_context = rule_match
+        ruled = OrchestratorOutput.model_construct(
+            intent=intent.value,
+            confidence=0.9,
+            query_summary=user_query,
+            requires_context=requires_context,
+            reasoning="Matched keyword routing rule"
+        )
+        return {"orchestrator_output": ruled.model_dump(mode="json"), "user_query": user_query}
+    
+    # Uploaded documents change the routing, so only cache document-free queries
+    query_vec = None
+    if not pdf_paths:
+        try:
+            cached, query_vec = route_cache.lookup(user_query)
+            if cached:
+                cached["query_summary"] = user_query
+                return {"orchestrator_output": cached, "user_query": user_query}
+        except Exception as ce:
+            print(f"DEBUG: Route cache unavailable: {ce}")
+    
     today_now = datetime.datetime.now()
     today_val = today_now.strftime("%Y-%m-%d")
     day_name = today_now.strftime("%A")
     
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a fast routing orchestrator. Analyze the user query and determine which agent should handle it.
-
-Today's Date: {today} ({day_name})
-
-Agent Types:
-- rag: Questions about documents, PDFs, syllabi, extracting information/tasks/timetables/events from files. Use this if documents are uploaded.
-- scheduler: Creating, modifying, or DELETING schedule/calendar events based on user requests or extracted document data. Use this for ANY changes to the schedule.
-- calendar: Viewing existing calendar events checking availability, listing what's planned (Read-only operations)
-- academic: GPA calculation, academic history, CGPA targets, grade path optimization, course enrollment management
-- chat: General conversation, greetings, help requests, unclear queries
-
-Rules for Routing:
-1. ANY request to DELETE, CLEAR, REMOVE, or WIPE events MUST be routed to 'scheduler'. Never route deletions to 'calendar'.
-2. If 'pdf_paths' is NOT empty and the query is about scheduling, tasks, or information, YOU MUST route to 'rag' first (or set 'requires_context' to true).
-3. If the user mentions "this file", "the document", "my syllabus", "timetable", or "from the PDF", route to 'rag'.
-4. If the user wants to PLAN/SCHEDULE based on document information, route to 'scheduler' and set 'requires_context' to true (this triggers a RAG lookup first).
-5. Use 'calendar' ONLY for reading existing events already in the database.
-{pdf_hint}
-
-{format_instructions}
-
-Be decisive and quick. Extract key entities (dates, tasks, subjects) from the query. Ensure 'requires_context' is False for simple deletions.
-"""),
-        ("human", "User Query: {query}")
-    ])
-    
     try:
-        from llm_config import chat_llm # Use chat_llm for orchestrator to avoid tool conflicts
-        response = chat_llm.invoke(prompt.format(
+        # The base model, not get_orchestrator_llm(): bound tools conflict with the JSON-only reply
+        response = get_llm().invoke(_ORCH_PROMPT.format(
             query=user_query,
             today=today_val,
             day_name=day_name,
             pdf_hint=pdf_hint,
-            format_instructions=parser.get_format_instructions()
+            format_instructions=_ORCH_FORMAT_INSTRUCTIONS
         ))
         
         # Parse the structured output
-        content = response.content if isinstance(response.content, str) else str(response.content)
-        clean_content = content.strip()
-        
-        # Robust JSON extraction
-        if "```json" in clean_content:
-            import re
-            match = re.search(r"```json(.*?)```", clean_content, re.DOTALL)
-            if match:
-                clean_content = match.group(1).strip()
-        elif "{" in clean_content and "}" in clean_content:
-            start_index = clean_content.find("{")
-            end_index = clean_content.rfind("}") + 1
-            clean_content = clean_content[start_index:end_index]
+        content = content_to_str(response.content)
+        clean_content = extract_json(content.strip())
 
         try:
-            parsed = parser.parse(clean_content)
+            parsed = OrchestratorOutput.model_validate_json(clean_content)
             print(f"DEBUG: Orchestrator detected intent: {parsed.intent}")
-        except Exception as pe:
-            # Prioritize scheduler for modifications
-            requires_context = False
-            if any(k in lower_content for k in ["clear", "delete", "remove", "update", "schedule", "add"]):
-                detected_intent = AgentType.SCHEDULER
-                # Only require context if specifically asking about documents or adding from them
-                if "from" in lower_content or "pdf" in lower_content or "document" in lower_content:
-                    requires_context = True
-            elif any(k in lower_content for k in ["rag", "pdf", "document", "timetable", "syllabus"]):
-                detected_intent = AgentType.RAG
-                requires_context = True
-            elif "calendar" in lower_content or "events" in lower_content:
-                detected_intent = AgentType.CALENDAR
+        except ValidationError as pe:
+            # Salvage the intent from malformed JSON (e.g. '"intent": "scheduler"'), else default to chat
+            intent_match = _INTENT_FIELD_RE.search(clean_content)
+            intent_value = intent_match.group(1).lower() if intent_match else None
+            detected_intent = next(
+                (agent for agent in AgentType if agent.value == intent_value),
+                AgentType.CHAT
+            )
+            requires_context = _REQUIRES_CONTEXT_FIELD_RE.search(clean_content) is not None
             
             print(f"DEBUG: Orchestrator FALLBACK intent: {detected_intent}, requires_context: {requires_context}")
-            parsed = OrchestratorOutput(
-                intent=detected_intent,
+            parsed = OrchestratorOutput.model_construct(
+                intent=detected_intent.value,
                 confidence=0.4,
                 query_summary=user_query,
                 requires_context=requires_context,
                 reasoning=f"Naive fallback due to parsing error: {str(pe)}"
             )
 
+        result = parsed.model_dump(mode="json")
+        if query_vec is not None:
+            route_cache.store(user_query, query_vec, result)
+
         return {
-            "orchestrator_output": parsed.model_dump(),
+            "orchestrator_output": result,
             "user_query": user_query
         }
     except Exception as e:
         # Final fallback
-        fallback = OrchestratorOutput(
-            intent=AgentType.CHAT,
+        fallback = OrchestratorOutput.model_construct(
+            intent=AgentType.CHAT.value,
             confidence=0.1,
             query_summary=user_query,
             reasoning=f"Critical fallback: {str(e)}"
         )
         return {
-            "orchestrator_output": fallback.model_dump(),
+            "orchestrator_output": fallback.model_dump(mode="json"),
             "user_query": user_query,
             "error": str(e)
         }
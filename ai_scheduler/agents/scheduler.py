@@ -1,42 +1,44 @@
-import json
+import os
+import re
+import orjson
+import logging
+import asyncio
 import datetime
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import ToolMessage
+from langchain_core.callbacks.manager import adispatch_custom_event
 from models import MultiAgentState, SchedulerOutput, CurrentState
-from llm_config import scheduler_llm
+from llm_config import get_scheduler_llm, content_to_str
 from database import db_manager
+from semantic_cache import SemanticLRU, needs_exact_match, normalize_query, unit_embedding
+from utils import (
+    get_current_date, list_calendar_events, search_calendar, add_event, bulk_add_events,
+    delete_calendar_event, delete_events_on_date, update_calendar_event, 
+    clear_full_calendar, list_available_courses, enroll_student_in_course, 
+    unenroll_student_from_course, get_my_enrolled_courses, retrieve_from_docs
+)
 
-def scheduler_agent(state: MultiAgentState) -> dict:
-    """
-    Scheduler Agent: Proposes schedule updates.
-    Uses tools to dynamically query the calendar context instead of full prompt injection.
-    """
-    query = state.get("user_query", "")
-    rag_output = state.get("rag_output", {})
-    current_state = state.get("current_state", {})
-    
-    # Extract context from RAG if available
-    rag_context = ""
-    if rag_output:
-        rag_context = f"""
-Information extracted from user documents:
-- Deadlines: {json.dumps(rag_output.get('extracted_deadlines', []))}
-- Timetable: {json.dumps(rag_output.get('extracted_timetable', []))}
-"""
-    
-    today_now = datetime.datetime.now()
-    today_val = today_now.strftime("%Y-%m-%d")
-    day_name = today_now.strftime("%A")
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("SCHEDULER_LOG_LEVEL", "INFO").upper())
 
-    # Generate next 14 days mapping for absolute accuracy
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+@lru_cache(maxsize=2)
+def _date_context(today_ordinal: int) -> str:
+    """Day-name to date mapping for the next 14 days, built once per day."""
     date_mapping = []
-    for i in range(14):
-        future_date = today_now + datetime.timedelta(days=i)
-        date_mapping.append(f"- {future_date.strftime('%A')}: {future_date.strftime('%Y-%m-%d')}")
-    date_context = "\n".join(date_mapping)
+    for ordinal in range(today_ordinal, today_ordinal + 14):
+        future_date = datetime.date.fromordinal(ordinal)
+        date_mapping.append(f"- {WEEKDAYS[future_date.weekday()]}: {future_date.isoformat()}")
+    return "\n".join(date_mapping)
 
-    # Build the prompt - note: we don't use format_instructions since we're using tool calling
-    # The model should call tools directly, not output JSON in a specific format
-    system_message = f"""You are a high-level Scheduling & Execution Agent. You manage the user's calendar by combining direct instructions with information retrieved from academic documents.
+# Build the prompt - note: we don't use format_instructions since we're using tool calling
+# The model should call tools directly, not output JSON in a specific format
+_SCHEDULER_SYSTEM_PROMPT = """You are a high-level Scheduling & Execution Agent. You manage the user's calendar by combining direct instructions with information retrieved from academic documents.
 
 Your capabilities:
 1. **Search/List**: Use 'search_calendar' or 'list_calendar_events' to see the current state of the calendar.
@@ -56,103 +58,295 @@ If a user wants to schedule classes from a timetable (provided in RAG context):
 - If the user's query is to CLEAR, DELETE, or SEARCH, do that FIRST and IGNORE the RAG timetable unless specifically asked to add it.
 - YOU MUST CALL 'add_event' SEPARATELY FOR EVERY SINGLE CLASS SLOT FOUND IN THE RAG CONTEXT (if adding).
 - USE THE DATE MAPPING BELOW to resolve day names (e.g., "Monday") to the correct date.
-- Pick the FIRST occurrence of that day name starting from today ({today_val}) or the next week as appropriate.
+- Pick the FIRST occurrence of that day name starting from today (given below) or the next week as appropriate.
 - DO NOT schedule everything on the same day. Use the date that matches the day name.
 - DO NOT summarize classes in text until you have made the tool calls.
 
 **CRITICAL CLEARING INSTRUCTION:**
 If the user asks to "clear", "wipe", "delete everything", "delete all", or "reset" the calendar, you MUST immediately call `clear_full_calendar` as your FIRST and ONLY tool call. Do NOT call list_calendar_events or retrieve_from_docs first. Just call clear_full_calendar directly.
 
-Upcoming Date Mapping (Next 14 Days):
+Never call 'add_event' again for an event whose tool result already says "Successfully added" or "Skipped".
+After completing the requested actions via tool calls, provide a brief summary of what was done."""
+
+# Dynamic context follows the static instructions so the instructions stay a cacheable
+# prefix; the date mapping changes once a day and the RAG context per request.
+_SCHEDULER_CONTEXT_PROMPT = """Upcoming Date Mapping (Next 14 Days):
 {date_context}
 
-Today's Date: {today_val} ({day_name})
+Today's Date: {today} ({day_name})
 
-{rag_context}
+{rag_context}"""
 
-After completing the requested actions via tool calls, provide a brief summary of what was done."""
+_SCHEDULER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _SCHEDULER_SYSTEM_PROMPT),
+    ("system", _SCHEDULER_CONTEXT_PROMPT),
+    ("human", "Scheduling Request: {query}")
+])
+
+READ_ONLY_TOOLS = {"list_calendar_events", "search_calendar", "retrieve_from_docs"}
+# Tools that touch many events at once; they run alone, in call order, between parallel groups
+BARRIER_TOOLS = {"clear_full_calendar", "delete_events_on_date"}
+BULK_ADD_THRESHOLD = 3
+MAX_TRACKED_ACTIONS = 256
+
+# Whole-request matches only, so "clear my Monday" still goes through the LLM
+_CLEAR_RE = re.compile(
+    r"^\s*(?:please\s+)?(?:(?:clear|wipe|reset)(?:\s+(?:my|the))?(?:\s+(?:entire|whole|full))?\s+(?:calendar|schedule)"
+    r"|delete\s+(?:everything|all(?:\s+my)?\s+events))(?:\s+please)?\s*[.!]*\s*$",
+    re.IGNORECASE
+)
+_LIST_RE = re.compile(
+    r"^\s*(?:please\s+)?(?:list|show)(?:\s+me)?\s+(?:all\s+)?(?:my|the)\s+(?:upcoming\s+)?(?:events|calendar|schedule)\s*[.!?]*\s*$",
+    re.IGNORECASE
+)
+# Requests that ask for a change never use the response cache, however similar they look to a cached lookup
+_WRITE_RE = re.compile(
+    r"\b(?:add|schedule|create|book|put|set|delete|remove|cancel|clear|wipe|reset|update|change|move|reschedule|rename|enroll|drop)\b",
+    re.IGNORECASE
+)
+
+_TOOL_MAP = {
+    "get_current_date": get_current_date,
+    "list_calendar_events": list_calendar_events,
+    "search_calendar": search_calendar,
+    "add_event": add_event,
+    "delete_calendar_event": delete_calendar_event,
+    "delete_events_on_date": delete_events_on_date,
+    "update_calendar_event": update_calendar_event,
+    "clear_full_calendar": clear_full_calendar,
+    "list_available_courses": list_available_courses,
+    "enroll_student_in_course": enroll_student_in_course,
+    "unenroll_student_from_course": unenroll_student_from_course,
+    "get_my_enrolled_courses": get_my_enrolled_courses,
+    "retrieve_from_docs": retrieve_from_docs
+}
+
+class SchedulerResponseCache:
+    """
+    LRU cache of read-only scheduler answers keyed on query embeddings.
+    Entries are scoped to (user, day, RAG context, calendar version), so any calendar write invalidates them.
+    """
+
+    def __init__(self, max_size: int = 256, threshold: float = 0.95):
+        self._lru = SemanticLRU(max_size, threshold)  # (scope, normalized query) -> scheduler output
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_message),
-        ("human", "Scheduling Request: {query}")
-    ])
+    def lookup(self, scope: tuple, query: str):
+        """
+        Returns (cached output or None, query vector or None) for the given query within a scope.
+        Queries naming a date, weekday or number only match an exact repeat and are never embedded.
+        """
+        cached = self._lru.get((scope, normalize_query(query)))
+        if cached is not None:
+            return dict(cached), None
+        vec = None if needs_exact_match(query) else unit_embedding(query)
+        cached = self._lru.nearest(vec, where=lambda key: key[0] == scope)
+        return (dict(cached) if cached is not None else None), vec
+
+    def store(self, scope: tuple, query: str, vec, output: dict):
+        self._lru.put((scope, normalize_query(query)), vec, output)
+
+
+response_cache = SchedulerResponseCache()
+
+async def _emit_progress(name: str, data: dict):
+    """Streams scheduler progress to astream_events consumers; a no-op outside a graph run."""
     try:
-        # Initial invocation - only pass query since rag_context is already in system_message
-        response = scheduler_llm.invoke(prompt.format(query=query))
+        await adispatch_custom_event(name, data)
+    except RuntimeError:
+        pass
+
+def _run_tool_batch(tool_map: dict, pending: list) -> list:
+    """
+    Runs one LLM turn's tool calls concurrently and returns
+    (slot, name, args, signature, result, error) tuples in call order.
+    Calls on the same event (same event_id, or same title and start for add_event)
+    share a lane and run sequentially; barrier tools split the batch into phases.
+    Three or more add_event calls in a phase are written in one bulk transaction.
+    """
+    def run_lane(lane):
+        results = []
+        for slot, t_name, t_args, signature in lane:
+            try:
+                results.append((slot, t_name, t_args, signature, tool_map[t_name].invoke(t_args), None))
+            except Exception as e:
+                results.append((slot, t_name, t_args, signature, None, e))
+        return results
+    
+    phases = [[]]
+    for job in pending:
+        if job[1] in BARRIER_TOOLS:
+            phases.extend([[job], []])
+        else:
+            phases[-1].append(job)
+    
+    def run_bulk_add(jobs):
+        try:
+            messages = bulk_add_events([job[2] for job in jobs], user_id=jobs[0][2].get("user_id", 1))
+            return [(slot, t_name, t_args, signature, msg, None) for (slot, t_name, t_args, signature), msg in zip(jobs, messages)]
+        except Exception as e:
+            return [(slot, t_name, t_args, signature, None, e) for slot, t_name, t_args, signature in jobs]
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for phase in phases:
+            # Many add_event calls (e.g. a whole timetable) become one bulk insert transaction
+            add_jobs = [job for job in phase if job[1] == "add_event"]
+            bulk_future = None
+            if len(add_jobs) >= BULK_ADD_THRESHOLD:
+                bulk_future = executor.submit(run_bulk_add, add_jobs)
+                phase = [job for job in phase if job[1] != "add_event"]
+            
+            lanes = {}
+            for job in phase:
+                slot, t_name, t_args, _ = job
+                if t_args.get("event_id") is not None:
+                    key = ("event", t_args["event_id"])
+                elif t_name == "add_event":
+                    key = ("slot", t_args.get("title"), t_args.get("start_datetime"))
+                else:
+                    key = ("call", slot)
+                lanes.setdefault(key, []).append(job)
+            for lane_results in executor.map(run_lane, lanes.values()):
+                results.extend(lane_results)
+            if bulk_future:
+                results.extend(bulk_future.result())
+    return sorted(results, key=lambda r: r[0])
+
+async def scheduler_agent(state: MultiAgentState) -> dict:
+    """
+    Scheduler Agent: Proposes schedule updates.
+    Uses tools to dynamically query the calendar context instead of full prompt injection.
+    Async so LLM waits don't hold the event loop; blocking tool and cache work runs in threads.
+    """
+    query = state.get("user_query", "")
+    rag_output = state.get("rag_output", {})
+    current_state = state.get("current_state", {})
+    
+    user_id_raw = str(state.get("user_id", "1"))
+    user_id_val = int(user_id_raw) if user_id_raw.isdigit() else 1
+    
+    # Trivial requests map to a single tool; answer them without an LLM call
+    fast_tool = "clear_full_calendar" if _CLEAR_RE.match(query) else "list_calendar_events" if _LIST_RE.match(query) else None
+    if fast_tool:
+        try:
+            res = await asyncio.to_thread(_TOOL_MAP[fast_tool].invoke, {"user_id": user_id_val})
+            rationale = res if fast_tool == "clear_full_calendar" else f"Here are your upcoming events:\n{res}"
+            parsed = SchedulerOutput.model_construct(scheduling_rationale=rationale, proposed_events=[])
+            return {"scheduler_output": parsed.model_dump(exclude_unset=True), "current_state": current_state}
+        except Exception as e:
+            logger.warning("Fast path %s failed, falling back to LLM: %s", fast_tool, e)
+    
+    # Extract context from RAG if available
+    rag_context = ""
+    if rag_output:
+        rag_context = f"""
+Information extracted from user documents:
+- Deadlines: {rag_output.get('_deadlines_json') or orjson.dumps(rag_output.get('extracted_deadlines', [])).decode()}
+- Timetable: {rag_output.get('_timetable_json') or orjson.dumps(rag_output.get('extracted_timetable', [])).decode()}
+"""
+    
+    today = datetime.date.today()
+    today_val = today.isoformat()
+    day_name = WEEKDAYS[today.weekday()]
+
+    prompt_vars = {
+        "today": today_val,
+        "day_name": day_name,
+        # Generate next 14 days mapping for absolute accuracy
+        "date_context": _date_context(today.toordinal()),
+        "rag_context": rag_context
+    }
+
+    # Read-only answers are reusable until the user's calendar changes
+    cache_scope = (
+        user_id_val,
+        today_val,
+        hashlib.sha1(rag_context.encode()).hexdigest(),
+        db_manager.schedule_version
+    )
+    cache_vec = None
+    cache_checked = False
+    if not _WRITE_RE.search(query):
+        try:
+            cached, cache_vec = await asyncio.to_thread(response_cache.lookup, cache_scope, query)
+            cache_checked = True
+            if cached:
+                logger.debug("scheduler_agent: semantic cache hit")
+                return {"scheduler_output": cached, "current_state": current_state}
+        except Exception as e:
+            logger.warning("Scheduler cache lookup failed: %s", e)
+
+    try:
+        # Rendered once; tool turns are appended as messages so the prefix never changes
+        messages = _SCHEDULER_PROMPT.format_messages(query=query, **prompt_vars)
+        response = await get_scheduler_llm().ainvoke(messages)
         
         # DEBUG: Check what the LLM returned
-        print(f"DEBUG scheduler_agent: tool_calls={response.tool_calls if hasattr(response, 'tool_calls') else 'None'}")
-        print(f"DEBUG scheduler_agent: content_start={str(response.content)[:100] if response.content else 'Empty'}")
+        if logger.isEnabledFor(logging.DEBUG):
+            usage = getattr(response, "usage_metadata", None) or {}
+            logger.debug("scheduler_agent: cache_read_tokens=%s", usage.get("input_token_details", {}).get("cache_read", 0))
+            logger.debug("scheduler_agent: tool_calls=%s", getattr(response, "tool_calls", None))
+            logger.debug("scheduler_agent: content_start=%.100s", response.content or "Empty")
         
         # --- TOOL CALL LOOP (Handles CRUD tools) ---
         iterations = 0
-        executed_actions = set() # Track unique actions to prevent loops (except read-only)
+        executed_actions = OrderedDict() # Track unique actions to prevent loops (except read-only); capped LRU of digests
         all_tool_results = []  # Collect all tool results for summary generation
+        read_only = True  # Only answers that called nothing but read-only tools are cached
         
         while hasattr(response, "tool_calls") and response.tool_calls and iterations < 6:
             iterations += 1
-            from utils import (
-                get_current_date, list_calendar_events, search_calendar, add_event, 
-                delete_calendar_event, delete_events_on_date, update_calendar_event, 
-                clear_full_calendar, list_available_courses, enroll_student_in_course, 
-                unenroll_student_from_course, get_my_enrolled_courses, retrieve_from_docs
-            )
-            tool_map = {
-                "get_current_date": get_current_date,
-                "list_calendar_events": list_calendar_events,
-                "search_calendar": search_calendar,
-                "add_event": add_event,
-                "delete_calendar_event": delete_calendar_event,
-                "delete_events_on_date": delete_events_on_date,
-                "update_calendar_event": update_calendar_event,
-                "clear_full_calendar": clear_full_calendar,
-                "list_available_courses": list_available_courses,
-                "enroll_student_in_course": enroll_student_in_course,
-                "unenroll_student_from_course": unenroll_student_from_course,
-                "get_my_enrolled_courses": get_my_enrolled_courses,
-                "retrieve_from_docs": retrieve_from_docs
-            }
-            
             tool_context = []
             new_actions_performed = False
+            pending = []  # (tool_context slot, name, args, signature) to dispatch
+            batch_signatures = set()
             
             for tool_call in response.tool_calls:
                 t_name = tool_call["name"]
-                t_args_str = json.dumps(tool_call["args"], sort_keys=True) 
-                action_signature = f"{t_name}:{t_args_str}" # Use for tracking executed actions
+                if t_name not in READ_ONLY_TOOLS:
+                    read_only = False
+                t_args_str = orjson.dumps(tool_call["args"], option=orjson.OPT_SORT_KEYS).decode()
+                # Fixed-size digest for tracking executed actions
+                action_signature = hashlib.blake2b(f"{t_name}\0{t_args_str}".encode(), digest_size=16).digest()
                 
-                print(f"DEBUG: Executing tool '{t_name}' with args {t_args_str}")
+                logger.debug("Executing tool %s args=%s", t_name, t_args_str)
                 
-                # Check for duplicates, but allow read-only tools to re-run
-                if action_signature in executed_actions:
-                    if t_name not in ["list_calendar_events", "search_calendar", "retrieve_from_docs"]: # Updated condition from instruction
-                        print(f"DEBUG: Skipping duplicate tool call: {t_name}")
-                        tool_context.append(f"Result for already executed action: {t_name} was successful.")
+                # Check for duplicates (including within this batch), but allow read-only tools to re-run
+                if action_signature in executed_actions or action_signature in batch_signatures:
+                    if t_name not in READ_ONLY_TOOLS:
+                        logger.debug("Skipping duplicate tool call: %s", t_name)
+                        tool_context.append(f"Already executed earlier: {t_name} was successful.")
                         continue
                     
-                if t_name in tool_map:
-                    try:
-                        # Inject user_id into tool arguments
-                        t_args = tool_call["args"]
-                        user_id_val = state.get("user_id", "1")
-                        if "user_id" not in t_args:
-                            try:
-                                t_args["user_id"] = int(user_id_val) if str(user_id_val).isdigit() else 1
-                            except:
-                                t_args["user_id"] = 1
-
-                        res = tool_map[t_name].invoke(t_args)
-                        print(f"DEBUG: Tool '{t_name}' returned: {str(res)[:100]}")
-                        tool_context.append(f"Tool Result ({t_name}): {res}")
-                        all_tool_results.append({"tool": t_name, "args": t_args, "result": str(res)})
-                        executed_actions.add(action_signature)
-                        new_actions_performed = True
-                    except Exception as e:
-                        print(f"DEBUG: Tool '{t_name}' error: {e}")
-                        tool_context.append(f"Tool Error ({t_name}): {str(e)}")
+                if t_name in _TOOL_MAP:
+                    # Inject user_id into tool arguments
+                    t_args = tool_call["args"]
+                    if "user_id" not in t_args:
+                        t_args["user_id"] = user_id_val
+                    
+                    tool_context.append(None)  # Filled in once the batch has run
+                    pending.append((len(tool_context) - 1, t_name, t_args, action_signature))
+                    batch_signatures.add(action_signature)
+                else:
+                    logger.warning("Tool %s not in _TOOL_MAP", t_name)
+                    tool_context.append(f"Error: Tool '{t_name}' not found")
+            
+            for _, t_name, _, _ in pending:
+                await _emit_progress("tool_start", {"name": t_name})
+            
+            for slot, t_name, t_args, action_signature, res, error in await asyncio.to_thread(_run_tool_batch, _TOOL_MAP, pending):
+                await _emit_progress("tool_result", {"name": t_name, "result": str(res) if error is None else f"Error: {error}"})
+                if error is None:
+                    logger.debug("Tool %s returned: %.100s", t_name, res)
+                    tool_context[slot] = str(res)
+                    all_tool_results.append({"tool": t_name, "args": t_args, "result": str(res)})
+                    executed_actions[action_signature] = None
+                    if len(executed_actions) > MAX_TRACKED_ACTIONS:
+                        executed_actions.popitem(last=False)
+                    new_actions_performed = True
                 else:
-                    print(f"DEBUG: Tool '{t_name}' not in tool_map!")
-                    tool_context.append(f"Action: {t_name} -> Error: Tool not found")
+                    logger.warning("Tool %s error: %s", t_name, error)
+                    tool_context[slot] = f"Error: {str(error)}"
             
             # Smart Breaking Condition
             if not new_actions_performed:
@@ -160,18 +354,14 @@ After completing the requested actions via tool calls, provide a brief summary o
                 if iterations > 1: 
                     break
             
-            # Re-invoke with context
-            if tool_context:
-                query_with_tools = f"{query}\n\nHistory of Executed Actions:\n" + "\n".join(tool_context)
-                response = scheduler_llm.invoke(prompt.format(
-                    query=query_with_tools + "\n\nCRITICAL: DO NOT call add_event for events that are already 'Successfully added' or 'Skipped' in the History above. Provide a final summary of what was done."
-                ))
-            else:
-                break
- # executed 0 tools? break.
+            # Answer every tool call in the conversation and let the LLM continue from there
+            messages.append(response)
+            for tool_call, result in zip(response.tool_calls, tool_context):
+                messages.append(ToolMessage(content=result, tool_call_id=tool_call["id"]))
+            response = await get_scheduler_llm().ainvoke(messages)
 
         # Build output from response content
-        content = response.content if isinstance(response.content, str) else str(response.content)
+        content = content_to_str(response.content)
         
         # Clean generic thinking tags
         clean_text = content.replace("<tool_code>", "").replace("</tool_code>", "").strip()
@@ -207,20 +397,22 @@ After completing the requested actions via tool calls, provide a brief summary o
                 clean_text = "No scheduling changes were made."
         
         # Create the output using SchedulerOutput model
-        parsed = SchedulerOutput(
+        parsed = SchedulerOutput.model_construct(
             scheduling_rationale=clean_text,
             proposed_events=[]
         )
 
+        output = parsed.model_dump(exclude_unset=True)
+        if read_only and cache_checked:
+            response_cache.store(cache_scope, query, cache_vec, output)
+
         return {
-            "scheduler_output": parsed.model_dump(),
+            "scheduler_output": output,
             "current_state": current_state
         }
     except Exception as e:
-        import traceback
-        print(f"ERROR in scheduler_agent: {str(e)}")
-        traceback.print_exc()
-        fallback = SchedulerOutput(
+        logger.exception("scheduler_agent failed")
+        fallback = SchedulerOutput.model_construct(
             scheduling_rationale=f"Error in scheduling: {str(e)}"
         )
-        return {"scheduler_output": fallback.model_dump(), "error": str(e)}
+        return {"scheduler_output": fallback.model_dump(exclude_unset=True), "error": str(e)}
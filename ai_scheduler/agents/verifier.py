@@ -1,24 +1,175 @@
-import json
+import orjson
+import datetime
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from models import MultiAgentState, VerifierOutput, ScheduleEvent
-from llm_config import verifier_llm
+from llm_config import get_llm, content_to_str
+
+# Larger batches than this are handed to the LLM verifier
+LLM_VERIFY_THRESHOLD = 50
+REQUIRED_EVENT_FIELDS = ("title", "start_datetime", "end_datetime")
+MIN_DURATION = datetime.timedelta(minutes=10)
+MAX_DURATION = datetime.timedelta(hours=12)
+
+_VERIFIER_PARSER = PydanticOutputParser(pydantic_object=VerifierOutput)
+_VERIFIER_FORMAT_INSTRUCTIONS = _VERIFIER_PARSER.get_format_instructions()
+
+_VERIFIER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a verification agent. Check proposed schedule changes for:
+1. Time conflicts with existing events
+2. Unrealistic time allocations (too short/long)
+3. Missing required information
+4. Logic errors (end before start, past dates)
+
+Current State:
+{current_state}
+
+Proposed Changes:
+{proposed_changes}
+
+{format_instructions}
+
+Be strict but fair.
+1. For approved_events, return the full event objects that should be saved.
+2. For approved_deletions, return the list of event IDs that are safe and requested to be deleted.
+"""),
+    ("human", "Verify these proposed changes.")
+])
+
+def _parse_dt(value) -> datetime.datetime:
+    """Parses an ISO datetime, dropping the timezone so naive and aware values compare."""
+    return datetime.datetime.fromisoformat(str(value)).replace(tzinfo=None)
+
+def _check_deletions(proposed_deletions: list, existing_events: list) -> tuple:
+    """Splits deletion IDs into (approved, rejected) by whether they exist; all are approved when no state is loaded."""
+    if not existing_events:
+        return [str(d) for d in proposed_deletions], []
+    known_ids = {str(e.get("id")) for e in existing_events}
+    approved, rejected = [], []
+    for d in proposed_deletions:
+        (approved if str(d) in known_ids else rejected).append(str(d))
+    return approved, rejected
+
+def _validate(proposed_events: list, proposed_deletions: list, existing_events: list) -> dict:
+    """
+    Deterministic verification: required fields, end after start, no past dates,
+    sensible durations and no overlaps with existing or other proposed events.
+    """
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+    conflicts, warnings, rejected = [], [], []
+    intervals = []  # (start, end, title, index into proposed_events or None for existing)
+
+    for e in existing_events:
+        try:
+            intervals.append((_parse_dt(e["start_datetime"]), _parse_dt(e["end_datetime"]), e.get("title", "Untitled"), None))
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    for i, event in enumerate(proposed_events):
+        missing = [f for f in REQUIRED_EVENT_FIELDS if not event.get(f)]
+        if missing:
+            rejected.append({"event": event, "reason": f"Missing required fields: {', '.join(missing)}"})
+            continue
+        try:
+            start, end = _parse_dt(event["start_datetime"]), _parse_dt(event["end_datetime"])
+        except (TypeError, ValueError) as e:
+            rejected.append({"event": event, "reason": f"Invalid datetime: {e}"})
+            continue
+        if end <= start:
+            rejected.append({"event": event, "reason": "End time is not after start time"})
+            continue
+        if start < today:
+            rejected.append({"event": event, "reason": "Event starts in the past"})
+            continue
+        if end - start < MIN_DURATION:
+            warnings.append(f"'{event['title']}' is unusually short ({end - start})")
+        elif end - start > MAX_DURATION:
+            warnings.append(f"'{event['title']}' is unusually long ({end - start})")
+        intervals.append((start, end, event["title"], i))
+
+    # Sweep by start time, comparing each interval against the one reaching furthest so far
+    conflicting = set()
+    latest = None
+    for interval in sorted(intervals, key=lambda iv: iv[0]):
+        if latest and interval[0] < latest[1] and (interval[3] is not None or latest[3] is not None):
+            conflicts.append(f"'{interval[2]}' at {interval[0].isoformat()} overlaps '{latest[2]}'")
+            if interval[3] is not None:
+                conflicting.add(interval[3])
+                continue  # Rejected proposals don't block later ones
+            # An existing event rejects the proposal it overlaps and still blocks everything after it
+            conflicting.add(latest[3])
+            latest = interval
+            continue
+        if latest is None or interval[1] > latest[1]:
+            latest = interval
+
+    for i in sorted(conflicting):
+        rejected.append({"event": proposed_events[i], "reason": "Time conflict"})
+    approved_deletions, missing_deletions = _check_deletions(proposed_deletions, existing_events)
+    for d in missing_deletions:
+        rejected.append({"event_id": d, "reason": "Event not found"})
+    checked = {iv[3] for iv in intervals if iv[3] is not None}
+    approved = [e for i, e in enumerate(proposed_events) if i in checked and i not in conflicting]
+
+    return VerifierOutput(
+        is_valid=not rejected,
+        conflicts=conflicts,
+        warnings=warnings,
+        approved_events=approved,
+        approved_deletions=approved_deletions,
+        rejected_events=rejected,
+        verification_notes=f"Approved {len(approved)} of {len(proposed_events)} proposed events."
+    ).model_dump()
+
+def _llm_verify(scheduler_output: dict, current_state: dict, proposed_events: list, proposed_deletions: list) -> dict:
+    """LLM verification, kept for batches too large to trust the deterministic checks alone."""
+    current_state_dict = current_state if current_state else {}
+    response = (_VERIFIER_PROMPT | get_llm()).invoke({
+        # Compact JSON: cheaper to encode and fewer prompt tokens than indented output
+        "current_state": orjson.dumps(current_state_dict.get('existing_events', [])[:10]).decode(),
+        "proposed_changes": orjson.dumps(scheduler_output).decode(),
+        "format_instructions": _VERIFIER_FORMAT_INSTRUCTIONS
+    })
+
+    # Ensure response.content is a string
+    content = content_to_str(response.content)
+
+    try:
+        parsed = _VERIFIER_PARSER.parse(content)
+        result = parsed.model_dump()
+    except Exception as parse_error:
+        # If parsing fails, do a simple validation and pass through events
+        result = {
+            "is_valid": True,
+            "verification_notes": f"Auto-approved (parser issue: {str(parse_error)})",
+            "approved_events": proposed_events,  # Pass through all proposed events
+            "conflicts": [],
+            "warnings": [f"Parse warning: {str(parse_error)}"],
+            "rejected_events": []
+        }
+
+    if result.get("is_valid"):
+        if not result.get("approved_events"):
+            result["approved_events"] = proposed_events
+        if not result.get("approved_deletions"):
+            result["approved_deletions"] = proposed_deletions
+    return result
 
 def verifier_agent(state: MultiAgentState) -> dict:
     """
     Verifier Agent: Validates proposed changes against current state.
-    Uses a fast, small LLM for quick verification.
+    Uses deterministic checks; only very large batches go through the LLM.
     """
     scheduler_output = state.get("scheduler_output", {})
     current_state = state.get("current_state", {})
-    
+
     if not scheduler_output:
         return {"verifier_output": {"is_valid": False, "verification_notes": "No scheduler output to verify"}}
-    
+
     # Extract proposed changes from scheduler output
     proposed_events = scheduler_output.get("proposed_events", [])
     proposed_deletions = scheduler_output.get("deleted_event_ids", [])
-    
+
     # If no changes proposed, just return early
     if not proposed_events and not proposed_deletions:
         return {
@@ -32,64 +183,27 @@ def verifier_agent(state: MultiAgentState) -> dict:
                 "rejected_events": []
             }
         }
-    
-    parser = PydanticOutputParser(pydantic_object=VerifierOutput)
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a verification agent. Check proposed schedule changes for:
-1. Time conflicts with existing events
-2. Unrealistic time allocations (too short/long)
-3. Missing required information
-4. Logic errors (end before start, past dates)
-
-Current State:
-{current_state}
-
-Proposed Changes:
-{proposed_changes}
 
-{format_instructions}
-
-Be strict but fair. 
-1. For approved_events, return the full event objects that should be saved.
-2. For approved_deletions, return the list of event IDs that are safe and requested to be deleted.
-"""),
-        ("human", "Verify these proposed changes.")
-    ])
-    
-    chain = prompt | verifier_llm
-    
-    try:
-        current_state_dict = current_state if current_state else {}
-        response = chain.invoke({
-            "current_state": json.dumps(current_state_dict.get('existing_events', [])[:10], indent=2),
-            "proposed_changes": json.dumps(scheduler_output, indent=2),
-            "format_instructions": parser.get_format_instructions()
-        })
-        
-        # Ensure response.content is a string
-        content = response.content if isinstance(response.content, str) else str(response.content)
-        
-        try:
-            parsed = parser.parse(content)
-            result = parsed.model_dump()
-        except Exception as parse_error:
-            # If parsing fails, do a simple validation and pass through events
-            result = {
+    # Deletions only need their IDs checked against the current calendar
+    if not proposed_events:
+        approved_deletions, missing_deletions = _check_deletions(proposed_deletions, (current_state or {}).get("existing_events", []))
+        return {
+            "verifier_output": {
                 "is_valid": True,
-                "verification_notes": f"Auto-approved (parser issue: {str(parse_error)})",
-                "approved_events": proposed_events,  # Pass through all proposed events
+                "verification_notes": f"Approved {len(approved_deletions)} of {len(proposed_deletions)} deletions.",
+                "approved_events": [],
+                "approved_deletions": approved_deletions,
                 "conflicts": [],
-                "warnings": [f"Parse warning: {str(parse_error)}"],
-                "rejected_events": []
+                "warnings": [],
+                "rejected_events": [{"event_id": d, "reason": "Event not found"} for d in missing_deletions]
             }
-        
-        if result.get("is_valid"):
-            if not result.get("approved_events"):
-                result["approved_events"] = proposed_events
-            if not result.get("approved_deletions"):
-                result["approved_deletions"] = proposed_deletions
-            
+        }
+
+    try:
+        if len(proposed_events) > LLM_VERIFY_THRESHOLD:
+            result = _llm_verify(scheduler_output, current_state, proposed_events, proposed_deletions)
+        else:
+            result = _validate(proposed_events, proposed_deletions, (current_state or {}).get("existing_events", []))
         return {"verifier_output": result}
     except Exception as e:
         # On error, still approve the events to avoid blocking user
@@ -105,4 +219,3 @@ Be strict but fair.
             },
             "error": str(e)
         }
-
@@ -1,17 +1,23 @@
 import os
-import shutil
+import asyncio
+import orjson
+from functools import lru_cache
 from typing import List, Optional
 from fastapi import FastAPI, Depends, HTTPException, Security, File, UploadFile
 from fastapi.security import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse, Response
 from starlette import status
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # Import the core logic from ched_backend
 from ched_backend import stream_query
+from agents.orchestrator import route_cache
+from rag_engine import vector_manager
 from database import db_manager
-from models import TodoItem
+from models import TodoItem, ScheduleEvent
+from utils import fast_copy, _normalize_priority
 
 
 load_dotenv()
@@ -25,18 +31,39 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
-def get_api_key(api_key: str = Security(api_key_header)):
-    """Validates the API key from the header."""
-    expected_key = os.getenv("API_KEY", "default-secret-key")
-    if api_key == expected_key:
+EXPECTED_API_KEY = os.getenv("API_KEY", "default-secret-key")
+
+async def get_api_key(api_key: str = Security(api_key_header)):
+    """Validates the API key from the header. Async so FastAPI runs it inline instead of on the threadpool."""
+    if api_key == EXPECTED_API_KEY:
         return api_key
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN, 
         detail="Invalid or missing API Key"
     )
 
-app = FastAPI(title="Ched Agentic Backend API")
+# orjson serializes the list-heavy responses (events, chat history, todos) much faster than the stdlib encoder
+app = FastAPI(title="Ched Agentic Backend API", default_response_class=ORJSONResponse)
+
+# Database calls block, so they run on the default thread pool instead of the event loop.
+# SQLite allows a single writer, so writes are queued here rather than contending for the file lock.
+_db_write_lock = asyncio.Semaphore(1)
+
+async def _db_read(fn, *args, **kwargs):
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+async def _db_write(fn, *args, **kwargs):
+    async with _db_write_lock:
+        return await asyncio.to_thread(fn, *args, **kwargs)
 
+@lru_cache(maxsize=1024)
+def _normalize_uid(user_id: str) -> int:
+    """Numeric user IDs map to themselves; anything else falls back to the default user 1."""
+    return int(user_id) if user_id.isdigit() else 1
+
+async def parse_uid(user_id: str = "1") -> int:
+    """Dependency resolving the optional user_id query parameter to an integer user ID."""
+    return _normalize_uid(user_id)
 
 
 class TodoRequest(BaseModel):
@@ -51,16 +78,16 @@ class TodoUpdate(BaseModel):
     text: Optional[str] = None
 
 @app.get("/todos")
-async def get_todos(user_id: str = "1", api_key: str = Depends(get_api_key)):
+async def get_todos(uid: int = Depends(parse_uid), api_key: str = Depends(get_api_key)):
     """Fetch all todos for a user."""
-    uid = int(user_id) if user_id.isdigit() else 1
-    return {"todos": db_manager.get_todos(uid)}
+    return {"todos": await _db_read(db_manager.get_todos, uid)}
 
 @app.post("/todos")
 async def add_todo(request: TodoRequest, api_key: str = Depends(get_api_key)):
     """Add a new todo."""
-    uid = int(request.user_id) if request.user_id.isdigit() else 1
-    todo_id = db_manager.add_todo(
+    uid = _normalize_uid(request.user_id)
+    todo_id = await _db_write(
+        db_manager.add_todo,
         user_id=uid,
         text=request.text,
         due_date=request.due_date,
@@ -72,7 +99,7 @@ async def add_todo(request: TodoRequest, api_key: str = Depends(get_api_key)):
 @app.patch("/todos/{todo_id}")
 async def update_todo(todo_id: int, request: TodoUpdate, api_key: str = Depends(get_api_key)):
     """Update a todo."""
-    success = db_manager.update_todo(todo_id, completed=request.completed, text=request.text)
+    success = await _db_write(db_manager.update_todo, todo_id, completed=request.completed, text=request.text)
     if not success:
         raise HTTPException(status_code=404, detail="Todo not found")
     return {"status": "success"}
@@ -80,16 +107,15 @@ async def update_todo(todo_id: int, request: TodoUpdate, api_key: str = Depends(
 @app.delete("/todos/{todo_id}")
 async def delete_todo(todo_id: int, api_key: str = Depends(get_api_key)):
     """Delete a todo."""
-    success = db_manager.delete_todo(todo_id)
+    success = await _db_write(db_manager.delete_todo, todo_id)
     if not success:
         raise HTTPException(status_code=404, detail="Todo not found")
     return {"status": "success"}
 
 @app.delete("/todos")
-async def clear_todos(user_id: str = "1", api_key: str = Depends(get_api_key)):
+async def clear_todos(uid: int = Depends(parse_uid), api_key: str = Depends(get_api_key)):
     """Clear all todos for a user."""
-    uid = int(user_id) if user_id.isdigit() else 1
-    db_manager.clear_all_todos(uid)
+    await _db_write(db_manager.clear_all_todos, uid)
     return {"status": "success"}
 
 # Add CORS Middleware
@@ -113,52 +139,90 @@ class QueryRequest(BaseModel):
     thread_id: str = "default"
     user_id: str = "1"  # String for flexibility, defaults to "1"
 
-from fastapi.responses import StreamingResponse
-import json
+def _sse_frame(chunk: dict) -> bytes:
+    """Encodes a stream chunk as one SSE frame: a single orjson encode and a single bytes allocation."""
+    return b"data: %b\n\n" % orjson.dumps(chunk)
+
+# Long agent steps (LLM calls, document ingestion) can leave the stream silent; a comment frame keeps
+# proxies and the browser from timing the connection out
+SSE_KEEPALIVE_SECONDS = 15
+_SSE_KEEPALIVE_FRAME = b": keepalive\n\n"
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def _with_keepalive(frames):
+    """Re-yields SSE frames, emitting a keepalive comment whenever the source is silent for SSE_KEEPALIVE_SECONDS."""
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(frames))
+            # Wait on the same task across pings; cancelling __anext__ would abort the generator
+            done, _ = await asyncio.wait((pending,), timeout=SSE_KEEPALIVE_SECONDS)
+            if not done:
+                yield _SSE_KEEPALIVE_FRAME
+                continue
+            try:
+                frame = pending.result()
+            except StopAsyncIteration:
+                return
+            finally:
+                pending = None
+            yield frame
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        await frames.aclose()
 
 @app.post("/query")
 async def api_process_query(request: QueryRequest, api_key: str = Depends(get_api_key)):
     """Exposed endpoint to process queries using the multi-agent system with streaming."""
     try:
-        from ched_backend import stream_query
-        from database import db_manager
-        
-        uid = int(request.user_id) if request.user_id.isdigit() else 1
-        
-        # Save user message immediately
-        db_manager.save_message(
-            user_id=uid,
-            thread_id=request.thread_id,
-            role="user",
-            message=request.query,
-            intent=None
-        )
+        uid = _normalize_uid(request.user_id)
         
         all_paths = (request.file_paths or []) + (request.pdf_paths or [])
 
         async def event_generator():
-            final_response = ""
-            async for chunk_str in stream_query(
-                request.query, 
-                all_paths if all_paths else None, 
-                request.thread_id,
-                uid
-            ):
-                chunk = json.loads(chunk_str)
-                if chunk["type"] == "final":
-                    final_response = chunk.get("response", "")
-                    # We save the final response to DB here at the end of the stream
-                    db_manager.save_message(
+            saved = False
+            try:
+                async for chunk in stream_query(
+                    request.query, 
+                    all_paths if all_paths else None, 
+                    request.thread_id,
+                    uid
+                ):
+                    if chunk["type"] == "final":
+                        # Both turns are saved together at the end of the stream, in one transaction
+                        await _db_write(
+                            db_manager.save_message_pair,
+                            user_id=uid,
+                            thread_id=request.thread_id,
+                            user_message=request.query,
+                            assistant_message=chunk["response"],
+                            intent="chat" # Defaulting for now as orchestrator intent is nested
+                        )
+                        saved = True
+                    # Yield to the client
+                    yield _sse_frame(chunk)
+            finally:
+                # Keep the user's turn if the pipeline failed or the client went away before the answer.
+                # Disconnects arrive as GeneratorExit/CancelledError, so this can't be an except Exception;
+                # the write is shielded so a second cancellation can't drop it half-way.
+                if not saved:
+                    await asyncio.shield(_db_write(
+                        db_manager.save_message,
                         user_id=uid,
                         thread_id=request.thread_id,
-                        role="assistant",
-                        message=final_response,
-                        intent="chat" # Defaulting for now as orchestrator intent is nested
-                    )
-                # Yield to the client
-                yield f"data: {chunk_str}\n\n"
-
-        return StreamingResponse(event_generator(), media_type="text/event-stream")
+                        role="user",
+                        message=request.query,
+                        intent=None
+                    ))
+
+        return StreamingResponse(
+            _with_keepalive(event_generator()),
+            media_type="text/event-stream",
+            headers=_SSE_HEADERS
+        )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -181,8 +245,9 @@ async def upload_file(file: UploadFile = File(...), api_key: str = Depends(get_a
     file_path = os.path.join(UPLOAD_DIR, file.filename)
     
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # One worker-thread hop per upload: spooled-to-disk files are copied kernel-side,
+        # in-memory ones go out in a single large write
+        await asyncio.to_thread(fast_copy, file.file, file_path)
         
         return {
             "filename": file.filename,
@@ -193,29 +258,49 @@ async def upload_file(file: UploadFile = File(...), api_key: str = Depends(get_a
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
+# Constant bodies are serialized once at import. Each request still gets its own Response:
+# middleware (CORS) mutates a response's header list in place, so instances can't be shared.
+_SUPPORTED_FORMATS_BODY = orjson.dumps({
+    "supported_extensions": sorted(SUPPORTED_EXTENSIONS),
+    "description": "PDF documents, PowerPoint presentations (PPT/PPTX)"
+})
+_HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "ched-agentic-backend"})
+
+# The course response is reused while DatabaseManager serves the same catalogue object (it reloads courses.json
+# only when its mtime changes); enrollments are cached per academic_version, which every enroll/unenroll bumps
+_courses_cache = {"courses": None, "response": None}
+_enrolled_cache = {}  # user_id -> (academic_version, response)
+
 @app.get("/supported-formats")
 async def get_supported_formats():
     """Returns list of supported file formats for document upload."""
-    return {
-        "supported_extensions": list(SUPPORTED_EXTENSIONS),
-        "description": "PDF documents, PowerPoint presentations (PPT/PPTX)"
-    }
+    return Response(_SUPPORTED_FORMATS_BODY, media_type="application/json")
 
 @app.get("/courses")
 async def get_courses(api_key: str = Depends(get_api_key)):
     """Returns the list of available courses from the JSON data file."""
     try:
-        courses = db_manager.get_all_courses()
-        return {"courses": courses, "count": len(courses)}
+        courses = await _db_read(db_manager.get_all_courses)
+        if courses is _courses_cache["courses"]:
+            return _courses_cache["response"]
+        response = {"courses": courses, "count": len(courses)}
+        _courses_cache.update(courses=courses, response=response)
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to load courses: {str(e)}")
 
 @app.get("/enrolled-courses")
 async def get_enrolled_courses(api_key: str = Depends(get_api_key)):
     """Fetch all courses the user is currently enrolled in."""
+    version = db_manager.academic_version
+    cached = _enrolled_cache.get(1)
+    if cached and cached[0] == version:
+        return cached[1]
     try:
-        courses = db_manager.get_enrolled_courses(user_id=1)
-        return {"courses": courses, "count": len(courses)}
+        courses = await _db_read(db_manager.get_enrolled_courses, user_id=1)
+        response = {"courses": courses, "count": len(courses)}
+        _enrolled_cache[1] = (version, response)
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -228,7 +313,8 @@ class EnrollRequest(BaseModel):
 @app.post("/enroll")
 async def enroll_course(request: EnrollRequest, api_key: str = Depends(get_api_key)):
     """Enroll the user in a new course."""
-    success = db_manager.enroll_in_course(
+    success = await _db_write(
+        db_manager.enroll_in_course,
         user_id=1, 
         course_id=request.course_id,
         course_name=request.course_name, 
@@ -242,7 +328,7 @@ async def enroll_course(request: EnrollRequest, api_key: str = Depends(get_api_k
 @app.delete("/unenroll/{course_id}")
 async def unenroll_course(course_id: int, api_key: str = Depends(get_api_key)):
     """Drop a course enrollment."""
-    success = db_manager.unenroll_from_course(user_id=1, course_id=course_id)
+    success = await _db_write(db_manager.unenroll_from_course, user_id=1, course_id=course_id)
     if success:
         return {"status": "success", "message": f"Dropped course {course_id}"}
     raise HTTPException(status_code=404, detail="Course enrollment not found")
@@ -251,9 +337,6 @@ async def unenroll_course(course_id: int, api_key: str = Depends(get_api_key)):
 # CALENDAR ENDPOINTS (Frontend Sync)
 # ============================================================================
 
-from database import db_manager
-from models import ScheduleEvent
-
 class EventCreateRequest(BaseModel):
     title: str
     start_datetime: str  # ISO format: "2026-01-25T15:00:00"
@@ -272,6 +355,9 @@ class EventUpdateRequest(BaseModel):
     category: Optional[str] = None
     description: Optional[str] = None
 
+class EventDatesDeleteRequest(BaseModel):
+    dates: List[str]  # YYYY-MM-DD
+
 @app.get("/events")
 async def get_events(
     limit: int = 50,
@@ -284,9 +370,9 @@ async def get_events(
     Optional: Filter by date range (start_date, end_date) in ISO format.
     """
     if start_date and end_date:
-        events = db_manager.get_events_by_range(user_id=1, start_date=start_date, end_date=end_date)
+        events = await _db_read(db_manager.get_events_by_range, user_id=1, start_date=start_date, end_date=end_date)
     else:
-        events = db_manager.get_upcoming_events(user_id=1, limit=limit)
+        events = await _db_read(db_manager.get_upcoming_events, user_id=1, limit=limit)
         
     return {
         "events": events,
@@ -305,7 +391,7 @@ async def search_events(
     - query: Search in title and description
     - date: Filter by specific date (YYYY-MM-DD)
     """
-    events = db_manager.search_events(user_id=1, query=query, date=date)
+    events = await _db_read(db_manager.search_events, user_id=1, query=query, date=date)
     return {
         "events": events,
         "count": len(events),
@@ -323,8 +409,7 @@ async def create_event(
     """
     try:
         # Normalize priority to match model expectations (capitalized)
-        priority_map = {"low": "Low", "medium": "Medium", "high": "High"}
-        normalized_priority = priority_map.get(event.priority.lower(), "Medium")
+        normalized_priority = _normalize_priority(event.priority)
         
         # Normalize category (capitalize first letter)
         normalized_category = event.category.capitalize() if event.category else "General"
@@ -339,7 +424,7 @@ async def create_event(
             source=event.source
 
         )
-        db_manager.add_schedule_event(schedule_event, user_id=1)
+        await _db_write(db_manager.add_schedule_event, schedule_event, user_id=1)
         return {
             "status": "success",
             "message": f"Event '{event.title}' created successfully",
@@ -363,7 +448,7 @@ async def update_event(
     if not update_dict:
         raise HTTPException(status_code=400, detail="No update fields provided")
     
-    success = db_manager.update_event(event_id=event_id, user_id=1, updates=update_dict)
+    success = await _db_write(db_manager.update_event, event_id=event_id, user_id=1, updates=update_dict)
     
     if success:
         return {
@@ -382,7 +467,7 @@ async def delete_event(
     """
     Delete a calendar event by ID.
     """
-    success = db_manager.delete_event(event_id=event_id, user_id=1)
+    success = await _db_write(db_manager.delete_event, event_id=event_id, user_id=1)
     
     if success:
         return {
@@ -400,19 +485,34 @@ async def delete_events_by_date(
     """
     Delete all events on a specific date (YYYY-MM-DD).
     """
-    count = db_manager.delete_events_by_date(date_str, user_id=1)
+    count = await _db_write(db_manager.delete_events_by_date, date_str, user_id=1)
     return {
         "status": "success",
         "message": f"Deleted {count} events on {date_str}",
         "count": count
     }
 
+@app.post("/events/delete-by-dates")
+async def delete_events_by_dates(
+    request: EventDatesDeleteRequest,
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Delete all events on any of the given dates (YYYY-MM-DD) in one transaction.
+    """
+    count = await _db_write(db_manager.delete_events_by_dates, request.dates, user_id=1)
+    return {
+        "status": "success",
+        "message": f"Deleted {count} events on {len(request.dates)} dates",
+        "count": count
+    }
+
 @app.get("/events/today")
 async def get_today_events(api_key: str = Depends(get_api_key)):
     """Get all events for today."""
     from datetime import date
     today = date.today().isoformat()
-    events = db_manager.search_events(user_id=1, date=today)
+    events = await _db_read(db_manager.search_events, user_id=1, date=today)
     return {
         "date": today,
         "events": events,
@@ -428,6 +528,7 @@ async def get_chat_history(
     user_id: str,
     thread_id: Optional[str] = None,
     limit: int = 100,
+    before_id: Optional[int] = None,
     api_key: str = Depends(get_api_key)
 ):
     """
@@ -435,10 +536,10 @@ async def get_chat_history(
     - user_id: Required. The user's unique identifier (string or numeric).
     - thread_id: Optional. If provided, returns messages from that thread only.
     - limit: Max messages to return (default: 100)
+    - before_id: Optional. Loads the page before this message id (pass the oldest id already shown).
     """
-    # Convert user_id to int if numeric, otherwise use as-is
-    uid = int(user_id) if user_id.isdigit() else 1
-    messages = db_manager.get_chat_history(uid, thread_id, limit)
+    uid = _normalize_uid(user_id)
+    messages = await _db_read(db_manager.get_chat_history, uid, thread_id, limit, before_id)
     return {
         "user_id": user_id,
         "thread_id": thread_id,
@@ -456,8 +557,8 @@ async def get_user_threads(
     Returns thread IDs with their last message time and message count.
     Use this to show a list of past conversations.
     """
-    uid = int(user_id) if user_id.isdigit() else 1
-    threads = db_manager.get_user_threads(uid)
+    uid = _normalize_uid(user_id)
+    threads = await _db_read(db_manager.get_user_threads, uid)
     return {
         "user_id": user_id,
         "threads": threads,
@@ -468,19 +569,28 @@ async def get_user_threads(
 @app.get("/health")
 async def health_check():
     """Service health check."""
-    return {"status": "healthy", "service": "ched-agentic-backend"}
+    return Response(_HEALTH_BODY, media_type="application/json")
+
+@app.get("/health/route-cache")
+async def route_cache_stats(api_key: str = Depends(get_api_key)):
+    """Orchestrator route cache size and hit rate."""
+    return route_cache.stats()
+
+@app.get("/health/retrieval-cache")
+async def retrieval_cache_stats(api_key: str = Depends(get_api_key)):
+    """Document retrieval cache size and hit rate."""
+    return vector_manager.retrieval_cache.stats()
 
 @app.delete("/chat/threads/{thread_id}")
 async def delete_thread(
     thread_id: str,
-    user_id: str = "1",
+    uid: int = Depends(parse_uid),
     api_key: str = Depends(get_api_key)
 ):
     """
     Delete a specific conversation thread and its history.
     """
-    uid = int(user_id) if user_id.isdigit() else 1
-    success = db_manager.delete_chat_thread(uid, thread_id)
+    success = await _db_write(db_manager.delete_chat_thread, uid, thread_id)
     if not success:
         raise HTTPException(status_code=500, detail="Failed to delete thread")
     return {"status": "success", "thread_id": thread_id}
@@ -491,6 +601,13 @@ if __name__ == "__main__":
     if "API_KEY" not in os.environ:
         print("WARNING: API_KEY environment variable not set. Using 'default-secret-key'.")
     
-    # When running as a script, we use the app object.
-    # If you want reload=True, you'd need the string path "ai_scheduler.api:app"
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # loop/http stay "auto": uvicorn picks uvloop and httptools when installed and falls back to asyncio/h11.
+    # Multiple workers (and reload=True) need the import-string form of the app. Each worker keeps its own
+    # in-memory graph checkpointer and caches, so only raise API_WORKERS behind sticky sessions.
+    workers = int(os.getenv("API_WORKERS", "1"))
+    uvicorn.run(
+        "api:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        workers=workers
+    )
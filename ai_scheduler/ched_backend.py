@@ -1,6 +1,6 @@
 import os
 import datetime
-import json
+import orjson
 from typing import List, Optional
 
 from langchain_core.messages import HumanMessage, AIMessage
@@ -25,6 +25,8 @@ from utils import get_current_calendar_events, create_calendar_event
 
 
 
+CALENDAR_PREVIEW_LIMIT = 10
+
 def response_synthesizer(state: MultiAgentState) -> dict:
     """
     Synthesizes final response from agent outputs.
@@ -75,11 +77,11 @@ def response_synthesizer(state: MultiAgentState) -> dict:
     if intent == "rag" and rag_output:
         response_parts.append(rag_output.get("synthesized_answer", ""))
         if rag_output.get("extracted_deadlines"):
-            response_parts.append(f"\n📅 **Extracted Deadlines:** {json.dumps(rag_output['extracted_deadlines'], indent=2)}")
+            response_parts.append(f"\n📅 **Extracted Deadlines:** {orjson.dumps(rag_output['extracted_deadlines'], option=orjson.OPT_INDENT_2).decode()}")
         if rag_output.get("extracted_tasks"):
-            response_parts.append(f"\n✅ **Extracted Tasks:** {json.dumps(rag_output['extracted_tasks'], indent=2)}")
+            response_parts.append(f"\n✅ **Extracted Tasks:** {orjson.dumps(rag_output['extracted_tasks'], option=orjson.OPT_INDENT_2).decode()}")
         if rag_output.get("extracted_timetable"):
-            response_parts.append(f"\n🗓️ **Extracted Timetable:** {json.dumps(rag_output['extracted_timetable'], indent=2)}")
+            response_parts.append(f"\n🗓️ **Extracted Timetable:** {orjson.dumps(rag_output['extracted_timetable'], option=orjson.OPT_INDENT_2).decode()}")
     
     elif intent == "scheduler" and scheduler_output:
         # The scheduler now executes tools directly. We just show the rationale/confirmations.
@@ -100,15 +102,15 @@ def response_synthesizer(state: MultiAgentState) -> dict:
             user_id = state.get("user_id", 1)
             if isinstance(user_id, str):
                 user_id = int(user_id) if user_id.isdigit() else 1
-            events = db_manager.get_upcoming_events(user_id=user_id)
+            # Only the first few are shown, so don't fetch more than that
+            events = db_manager.get_upcoming_events(user_id=user_id, limit=CALENDAR_PREVIEW_LIMIT)
             
         if events:
-            event_list = []
-            for e in events[:10]:
-                title = e.get('title') or e.get('summary', 'Untitled')
-                start = e.get('start_datetime') or e.get('start', {}).get('dateTime', 'N/A')
-                event_list.append(f"- {title} ({start})")
-            response_parts.append("📆 **Upcoming Events:**\n" + "\n".join(event_list))
+            event_list = "\n".join(
+                f"- {e.get('title') or e.get('summary', 'Untitled')} ({e.get('start_datetime') or e.get('start', {}).get('dateTime', 'N/A')})"
+                for e in events[:CALENDAR_PREVIEW_LIMIT]
+            )
+            response_parts.append("📆 **Upcoming Events:**\n" + event_list)
         else:
             response_parts.append("📆 No upcoming events found.")
     
@@ -129,39 +131,25 @@ def response_synthesizer(state: MultiAgentState) -> dict:
 # ROUTING LOGIC
 # ============================================================================
 
+_INTENT_TO_NODE = {
+    "rag": "rag",
+    "scheduler": "scheduler",
+    "calendar": "synthesize",
+    "academic": "academic",
+    "chat": "chat"
+}
+
 def route_after_orchestrator(state: MultiAgentState) -> str:
+    # The orchestrator emits intent as a plain string (AgentType is a str enum either way)
     orchestrator_output = state.get("orchestrator_output") or {}
     intent = orchestrator_output.get("intent", "chat")
-    if hasattr(intent, "value"):
-        intent = intent.value
-    intent = str(intent)
-    
-    requires_context = orchestrator_output.get("requires_context", False)
-    
-    if intent == "scheduler" and requires_context:
+    if intent == "scheduler" and orchestrator_output.get("requires_context", False):
         return "rag"
-    
-    intent_to_node = {
-        "rag": "rag",
-        "scheduler": "scheduler",
-        "calendar": "synthesize",
-        "academic": "academic",
-        "chat": "chat"
-    }
-    return intent_to_node.get(intent, "chat")
+    return _INTENT_TO_NODE.get(intent, "chat")
 
 def route_after_rag(state: MultiAgentState) -> str:
-    orchestrator_output = state.get("orchestrator_output") or {}
-    intent = orchestrator_output.get("intent", "")
-    
-    # Handle Enum objects
-    if hasattr(intent, "value"):
-        intent = intent.value
-    intent = str(intent)
-    
-    if intent == "scheduler":
-        return "scheduler"
-    return "synthesize"
+    intent = (state.get("orchestrator_output") or {}).get("intent", "")
+    return "scheduler" if intent == "scheduler" else "synthesize"
 
 def route_after_scheduler(state: MultiAgentState) -> str:
     return "synthesize"
@@ -217,6 +205,9 @@ app = build_multi_agent_graph()
 # INTERFACE FUNCTIONS
 # ============================================================================
 
+_STREAM_NODE_NAMES = frozenset({"orchestrator", "rag", "scheduler", "academic", "chat", "synthesize"})
+_PROGRESS_EVENTS = frozenset({"tool_start", "tool_result"})
+
 async def stream_query(
     user_query: str,
     pdf_paths: Optional[List[str]] = None,
@@ -225,6 +216,7 @@ async def stream_query(
 ):
     """
     Asynchronous generator that streams response chunks from the multi-agent system.
+    Chunks are plain dicts; callers serialize them once at the transport boundary.
     """
     config: RunnableConfig = {"configurable": {"thread_id": thread_id}}
     
@@ -252,29 +244,34 @@ async def stream_query(
     async for event in app.astream_events(initial_state, config=config, version="v2"):
         kind = event["event"]
         
-        # When a node starts processing
-        if kind == "on_chain_start":
-            if event["name"] in ["orchestrator", "rag", "scheduler", "academic", "chat", "synthesize"]:
-                last_node = event["name"]
-                
         # Capture streaming tokens from the LLM if they are part of a targeted node
         if kind == "on_chat_model_stream":
             content = event["data"]["chunk"].content
             if content:
-                yield json.dumps({"type": "token", "content": str(content)})
+                yield {"type": "token", "content": str(content)}
+        
+        # When a node starts processing
+        elif kind == "on_chain_start":
+            if event["name"] in _STREAM_NODE_NAMES:
+                last_node = event["name"]
+        
+        # Scheduler progress (tool started / tool result) as it happens
+        elif kind == "on_custom_event":
+            if event["name"] in _PROGRESS_EVENTS:
+                yield {"type": event["name"], **event["data"]}
         
         # When a node completes, we might want to send structured updates (like metadata)
-        if kind == "on_chain_end":
+        elif kind == "on_chain_end":
             if event["name"] == "synthesize":
                 data = event["data"]["output"]
                 final_response_content = data.get("final_response", "")
     
     # Final metadata result
-    yield json.dumps({
+    yield {
         "type": "final",
         "response": final_response_content,
         "status": "complete"
-    })
+    }
 
 def ingest_documents(pdf_paths: List[str], user_id: str = "default") -> bool:
     return vector_manager.ingest_documents(pdf_paths, user_id=user_id)
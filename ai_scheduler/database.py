@@ -1,9 +1,17 @@
-from typing import List
+from typing import List, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+import datetime
+import hashlib
+import struct
 import sqlite3
-import json
+import orjson
 import os
+import queue
+import threading
 from models import AcademicHistory, SemesterRecord, CourseGrade, ScheduleEvent
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.memory import MemorySaver
 
 # Define central database paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,6 +21,65 @@ os.makedirs(DATA_DIR, exist_ok=True)
 MAIN_DB_PATH = os.path.join(DATA_DIR, "users.db")
 CHED_DB_PATH = os.path.join(DATA_DIR, "ched_user_data.db")
 CHECKPOINT_DB_PATH = os.path.join(DATA_DIR, "multi_agent_checkpoints.db")
+COURSES_FILE = os.path.join(DATA_DIR, "courses.json")
+
+POOL_SIZE = max(8, os.cpu_count() or 1)
+POOL_WARM_CONNECTIONS = 4
+# WAL lets readers run alongside the single writer; busy_timeout waits out brief lock contention.
+# Reads go through a 256 MiB memory map and temp tables/sorts stay in RAM.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Parsed statements kept per connection; sqlite3's default of 128 is shared across every query in this module
+STATEMENT_CACHE_SIZE = 256
+
+# Columns returned for events; the internal dedup_hash stays out of API and tool output
+EVENT_COLUMNS = "id, user_id, title, start_datetime, end_datetime, priority, category, description, source"
+
+# Columns callers may update, in the canonical order their SET clauses are built in
+EVENT_UPDATE_FIELDS = ("title", "start_datetime", "end_datetime", "priority", "category", "description")
+
+@lru_cache(maxsize=64)
+def _update_sql(table: str, fields: tuple, where: str) -> str:
+    """Builds the UPDATE for one set of columns once, so repeat calls reuse the cached prepared statement."""
+    return f"UPDATE {table} SET {', '.join(f'{field} = ?' for field in fields)} WHERE {where}"
+
+def _fetch_dicts(cursor) -> List[dict]:
+    """Materializes result rows as dicts straight from the tuples, without an intermediate sqlite3.Row per row."""
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def _event_fingerprint(title, start_datetime) -> int:
+    """Signed 64-bit BLAKE2b fingerprint of an event's (title, start) pair, the key for schedule idempotency."""
+    digest = hashlib.blake2b(f"{title}|{start_datetime}".encode(), digest_size=8).digest()
+    return struct.unpack("<q", digest)[0]
+
+def _prefix_bounds(prefix: str) -> tuple:
+    """
+    Half-open [low, high) string range matching every value that starts with prefix.
+    Unlike LIKE 'prefix%', a range predicate can seek idx_sched_user_start.
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _build_name_index(courses: List[dict]) -> tuple:
+    """Lowercased lookup tables for course search: {name or code: id} plus (name, code, id) rows in catalog order."""
+    keys = tuple((c['name'].lower(), c.get('code', '').lower(), c['id']) for c in courses)
+    exact = {}
+    for name, code, course_id in keys:
+        exact.setdefault(name, course_id)
+        if code:
+            exact.setdefault(code, course_id)
+    return exact, keys
+
+# Recent threads are served from memory; threads longer than CHAT_CACHE_MESSAGES always go to SQLite
+CHAT_CACHE_THREADS = 512
+CHAT_CACHE_MESSAGES = 200
 
 print(f"DEBUG: DatabaseManager using CHED_DB at: {CHED_DB_PATH}")
 
@@ -22,11 +89,68 @@ class DatabaseManager:
     def __init__(self, main_db: str = MAIN_DB_PATH, secondary_db: str = CHED_DB_PATH):
         self.main_db = main_db
         self.secondary_db = secondary_db
+        # Bumped on every academic write so readers can memoize derived views
+        self.academic_version = 0
+        self.schedule_version = 0
+        self._pools = {main_db: queue.LifoQueue(maxsize=POOL_SIZE), secondary_db: queue.LifoQueue(maxsize=POOL_SIZE)}
+        self._write_lock = threading.Lock()
+        # (user_id, thread_id) -> full message list, in insertion order
+        self._thread_cache = OrderedDict()
+        self._thread_cache_lock = threading.Lock()
+        self._chat_version = 0
+        # Parsed courses.json, reloaded only when the file's mtime changes
+        self._courses = []
+        self._courses_by_id = {}
+        self._course_name_index = ({}, ())
+        self._courses_mtime = None
+        self._courses_lock = threading.Lock()
+        # course code -> (name, credits, courses.id) as last written, so repeat enrollments skip the registry upsert
+        self._course_rows = {}
         self._init_db()
+        # Open a few connections up front so the first burst of requests doesn't pay connect + PRAGMA cost
+        for pool_path, pool in self._pools.items():
+            while pool.qsize() < POOL_WARM_CONNECTIONS:
+                pool.put_nowait(self._new_connection(pool_path))
+    
+    @staticmethod
+    def _new_connection(db_path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(db_path, timeout=30.0, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function("event_fingerprint", 2, _event_fingerprint, deterministic=True)
+        return conn
+    
+    @contextmanager
+    def _connect(self, db_path: str, write: bool = False):
+        """
+        Borrows a pooled connection, committing on success and rolling back on error.
+        Writes are serialized on a process-wide lock since SQLite allows a single writer.
+        """
+        pool = self._pools[db_path]
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = self._new_connection(db_path)
+        lock = self._write_lock if write else None
+        if lock:
+            lock.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            if lock:
+                lock.release()
+            conn.row_factory = None
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                # Let SQLite refresh planner statistics for the tables this connection touched
+                conn.execute("PRAGMA optimize")
+                conn.close()
     
     def _init_db(self):
         # Initialize AI-specific tables (Schedule, Chat) in the CHED database
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
             print(f"DEBUG: Initializing/Checking tables in {self.secondary_db}")
             # Schedule Table
@@ -40,9 +164,28 @@ class DatabaseManager:
                     priority TEXT,
                     category TEXT,
                     description TEXT,
-                    source TEXT
+                    source TEXT,
+                    dedup_hash INTEGER
                 )
             """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_sched_user_start ON user_schedule(user_id, start_datetime)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_sched_user_source ON user_schedule(user_id, source)")
+            # Idempotency: one event per (user, title, start), enforced on a 64-bit fingerprint of the pair.
+            # Older databases are migrated the first time through: add and backfill the column, collapse
+            # duplicates to the earliest row, and replace the wide three-column unique index.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_sched_hash'")
+            if cursor.fetchone() is None:
+                cursor.execute("PRAGMA table_info(user_schedule)")
+                if "dedup_hash" not in {col[1] for col in cursor.fetchall()}:
+                    cursor.execute("ALTER TABLE user_schedule ADD COLUMN dedup_hash INTEGER")
+                cursor.execute("UPDATE user_schedule SET dedup_hash = event_fingerprint(title, start_datetime)")
+                cursor.execute("""
+                    DELETE FROM user_schedule WHERE id NOT IN (
+                        SELECT MIN(id) FROM user_schedule GROUP BY user_id, dedup_hash
+                    )
+                """)
+                cursor.execute("DROP INDEX IF EXISTS uq_sched_user_title_start")
+                cursor.execute("CREATE UNIQUE INDEX uq_sched_hash ON user_schedule(user_id, dedup_hash)")
             # Chat History Table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS chat_history (
@@ -55,6 +198,46 @@ class DatabaseManager:
                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_user_thread_ts ON chat_history(user_id, thread_id, timestamp)")
+            # Per-thread summary kept current by triggers, so listing threads reads one row per thread
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chat_threads (
+                    user_id INTEGER NOT NULL,
+                    thread_id TEXT NOT NULL,
+                    last_message_time DATETIME,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, thread_id)
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_threads_user_last ON chat_threads(user_id, last_message_time DESC)")
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_chat_threads_insert'")
+            if cursor.fetchone() is None:
+                cursor.execute("""
+                    CREATE TRIGGER trg_chat_threads_insert AFTER INSERT ON chat_history
+                    BEGIN
+                        INSERT INTO chat_threads (user_id, thread_id, last_message_time, message_count)
+                        VALUES (NEW.user_id, NEW.thread_id, NEW.timestamp, 1)
+                        ON CONFLICT(user_id, thread_id) DO UPDATE SET
+                            last_message_time = MAX(last_message_time, excluded.last_message_time),
+                            message_count = message_count + 1;
+                    END
+                """)
+                cursor.execute("""
+                    CREATE TRIGGER trg_chat_threads_delete AFTER DELETE ON chat_history
+                    BEGIN
+                        UPDATE chat_threads SET message_count = message_count - 1
+                        WHERE user_id = OLD.user_id AND thread_id = OLD.thread_id;
+                        DELETE FROM chat_threads
+                        WHERE user_id = OLD.user_id AND thread_id = OLD.thread_id AND message_count <= 0;
+                    END
+                """)
+                # Backfill summaries for history written before the triggers existed
+                cursor.execute("""
+                    INSERT OR REPLACE INTO chat_threads (user_id, thread_id, last_message_time, message_count)
+                    SELECT user_id, thread_id, MAX(timestamp), COUNT(*)
+                    FROM chat_history
+                    GROUP BY user_id, thread_id
+                """)
             # Todo Items Table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS todo_items (
@@ -68,10 +251,21 @@ class DatabaseManager:
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_todo_user_created ON todo_items(user_id, created_at DESC)")
+            # Content hashes of documents already embedded into a user's vector namespace
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ingested_documents (
+                    file_hash TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    path TEXT,
+                    ingested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (file_hash, user_id)
+                )
+            """)
             conn.commit()
 
         # Initialize main database tables for Enrollment
-        with sqlite3.connect(self.main_db, timeout=30.0) as conn:
+        with self._connect(self.main_db, write=True) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS courses (
@@ -92,40 +286,48 @@ class DatabaseManager:
                     UNIQUE(user_id, course_id)
                 )
             """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_usercourses_user_status ON user_courses(user_id, status)")
             conn.commit()
 
     def add_academic_record(self, record: SemesterRecord, user_id: int):
         """Unified method: Writes to the main dashboard database."""
-        with sqlite3.connect(self.main_db, timeout=30.0) as conn:
+        if not record.courses:
+            return
+        codes = list(dict.fromkeys(course.course_code for course in record.courses))
+        placeholders = ", ".join("?" * len(codes))
+        with self._connect(self.main_db, write=True) as conn:
             cursor = conn.cursor()
-            for course in record.courses:
-                # 1. Ensure course exists in the global registry
-                cursor.execute("SELECT id FROM courses WHERE code = ?", (course.course_code,))
-                res = cursor.fetchone()
-                if res:
-                    course_id = res[0]
-                else:
-                    cursor.execute(
-                        "INSERT INTO courses (name, code, credits, semester) VALUES (?, ?, ?, ?)",
-                        (course.course_code, course.course_code, course.credits, 1)
-                    )
-                    course_id = cursor.lastrowid
-                
-                # 2. Record/Update enrollment for this user
-                cursor.execute("""
-                    INSERT OR REPLACE INTO user_courses (user_id, course_id, grade, status)
-                    VALUES (?, ?, ?, ?)
-                """, (user_id, course_id, course.grade_point, 'completed' if course.grade_point is not None else 'active'))
-            conn.commit()
+            # 1. Ensure every course exists in the global registry, then resolve all IDs in one query
+            cursor.executemany(
+                "INSERT OR IGNORE INTO courses (name, code, credits, semester) VALUES (?, ?, ?, ?)",
+                [(course.course_code, course.course_code, course.credits, 1) for course in record.courses]
+            )
+            cursor.execute(f"SELECT code, id FROM courses WHERE code IN ({placeholders})", codes)
+            course_ids = dict(cursor.fetchall())
+            
+            # 2. Record/Update enrollment for this user
+            cursor.executemany("""
+                INSERT OR REPLACE INTO user_courses (user_id, course_id, grade, status)
+                VALUES (?, ?, ?, ?)
+            """, [
+                (user_id, course_ids[course.course_code], course.grade_point,
+                 'completed' if course.grade_point is not None else 'active')
+                for course in record.courses
+            ])
+        # Bumped only after the commit, so a reader that sees the new version also sees the new rows
+        self.academic_version += 1
 
     def get_full_academic_history(self, user_id: int) -> AcademicHistory:
         """Unified method: Reads from the main dashboard database."""
-        with sqlite3.connect(self.main_db, timeout=30.0) as conn:
+        with self._connect(self.main_db) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            # Join user_courses with courses to get full history
+            # Join user_courses with courses to get full history. The cumulative totals are
+            # column aggregates computed by SQLite in the same scan, not summed per row in Python.
             cursor.execute("""
-                SELECT c.code, c.name, c.credits, c.semester, uc.grade
+                SELECT c.code, c.credits, c.semester, uc.grade,
+                       SUM(CASE WHEN uc.grade IS NOT NULL THEN c.credits END) OVER () AS graded_credits,
+                       SUM(uc.grade * c.credits) OVER () AS grade_points
                 FROM user_courses uc
                 JOIN courses c ON uc.course_id = c.id
                 WHERE uc.user_id = ?
@@ -133,35 +335,30 @@ class DatabaseManager:
             rows = cursor.fetchall()
             
             semesters_dict = {}
-            total_credits = 0.0
-            total_points = 0.0
-            
+            # Rows come from our own schema, so the models are built without
+            # re-running Pydantic validation on every course
             for row in rows:
                 sem = f"Semester {row['semester']}"
                 if sem not in semesters_dict:
                     semesters_dict[sem] = []
-                
-                course = CourseGrade(
+                semesters_dict[sem].append(CourseGrade.model_construct(
                     course_code=row['code'],
-                    credits=row['credits'],
+                    credits=float(row['credits']),
                     grade_point=row['grade'],
                     letter_grade=None 
-                )
-                semesters_dict[sem].append(course)
-                
-                if row['grade'] is not None:
-                    total_credits += row['credits']
-                    total_points += (row['grade'] * row['credits'])
+                ))
             
-            history_records = []
-            for name, courses in semesters_dict.items():
-                record = SemesterRecord(semester_name=name, courses=courses)
-                history_records.append(record)
+            history_records = [
+                SemesterRecord.model_construct(semester_name=name, courses=courses, sgpa=None)
+                for name, courses in semesters_dict.items()
+            ]
             
+            total_credits = float(rows[0]['graded_credits'] or 0.0) if rows else 0.0
+            total_points = float(rows[0]['grade_points'] or 0.0) if rows else 0.0
             cgpa = (total_points / total_credits) if total_credits > 0 else 0.0
             
             # Use cumulative_credits to match models.py
-            return AcademicHistory(
+            return AcademicHistory.model_construct(
                 semesters=history_records, 
                 cumulative_credits=total_credits, 
                 cgpa=cgpa
@@ -169,18 +366,44 @@ class DatabaseManager:
 
     # --- Course Enrollment Methods ---
 
+    def _load_courses(self) -> tuple:
+        """Returns (courses, courses_by_id, name_index) from courses.json, re-parsing only when the file has changed."""
+        try:
+            mtime = os.stat(COURSES_FILE).st_mtime_ns
+        except FileNotFoundError:
+            return [], {}, ({}, ())
+        with self._courses_lock:
+            if mtime != self._courses_mtime:
+                with open(COURSES_FILE, "rb") as f:
+                    courses = orjson.loads(f.read())
+                self._courses = courses
+                self._courses_by_id = {c['id']: c for c in courses}
+                self._course_name_index = _build_name_index(courses)
+                self._courses_mtime = mtime
+            return self._courses, self._courses_by_id, self._course_name_index
+
+    def get_course(self, course_id: int) -> Optional[dict]:
+        """Catalog entry for a course ID, or None."""
+        return self._load_courses()[1].get(course_id)
+
+    def find_course_id(self, query: str) -> Optional[int]:
+        """Resolves a course name or code to its catalog ID: exact (case-insensitive) match first, then substring."""
+        exact, keys = self._load_courses()[2]
+        needle = query.strip().lower()
+        if not needle:
+            return None
+        if needle in exact:
+            return exact[needle]
+        # First catalog entry whose name or code contains the query, as the tools always matched
+        return next((course_id for name, code, course_id in keys if needle in name or needle in code), None)
+
     def get_all_courses(self) -> List[dict]:
         """Returns the list of available courses from the JSON data file."""
-        courses_file = os.path.join(DATA_DIR, "courses.json")
-        if not os.path.exists(courses_file):
-            return []
-        with open(courses_file, "r") as f:
-            return json.load(f)
+        return self._load_courses()[0]
 
     def get_enrolled_courses(self, user_id: int) -> List[dict]:
         """Fetch all courses a user is currently enrolled in (active status)."""
-        with sqlite3.connect(self.main_db, timeout=30.0) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connect(self.main_db) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT c.id, c.name, c.code, c.credits, uc.status, c.semester
@@ -188,17 +411,16 @@ class DatabaseManager:
                 JOIN courses c ON uc.course_id = c.id
                 WHERE uc.user_id = ? AND uc.status = 'active'
             """, (user_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            return _fetch_dicts(cursor)
 
     def enroll_in_course(self, user_id: int, course_id: int, course_name: str = None, course_code: str = None, credits: int = None) -> bool:
         """Enroll a user in a course. Ensures course exists and creates user_course entry."""
-        with sqlite3.connect(self.main_db, timeout=30.0) as conn:
+        with self._connect(self.main_db, write=True) as conn:
             cursor = conn.cursor()
             
             # If course_id is provided, try to get code/name from catalogue if not provided
             if course_id and (not course_code or not course_name):
-                catalogue = self.get_all_courses()
-                match = next((c for c in catalogue if c['id'] == course_id), None)
+                match = self.get_course(course_id)
                 if match:
                     course_name = course_name or match['name']
                     course_code = course_code or match['code']
@@ -213,43 +435,43 @@ class DatabaseManager:
                 else:
                     return False # Can't enroll without course info
 
-            # 1. Ensure course exists in central registry
-            cursor.execute("SELECT id FROM courses WHERE code = ?", (course_code,))
-            res = cursor.fetchone()
-            if not res:
-                cursor.execute(
-                    "INSERT INTO courses (name, code, credits, semester) VALUES (?, ?, ?, ?)",
-                    (course_name, course_code, credits or 3, 1)
-                )
-                db_course_id = cursor.lastrowid
+            # 1. Ensure course exists in central registry (insert or refresh, returning its id either way).
+            # Skipped when this exact name/credits pair was already written for the code.
+            known = self._course_rows.get(course_code)
+            if known and known[:2] == (course_name, credits):
+                db_course_id = known[2]
             else:
-                db_course_id = res[0]
-                if course_name or credits:
-                    cursor.execute(
-                        "UPDATE courses SET name = COALESCE(?, name), credits = COALESCE(?, credits) WHERE id = ?",
-                        (course_name, credits, db_course_id)
-                    )
+                cursor.execute("""
+                    INSERT INTO courses (name, code, credits, semester) VALUES (?, ?, ?, 1)
+                    ON CONFLICT(code) DO UPDATE SET name = COALESCE(?, name), credits = COALESCE(?, credits)
+                    RETURNING id
+                """, (course_name, course_code, credits or 3, course_name, credits))
+                db_course_id = cursor.fetchone()[0]
+                known = None
 
             # 2. Add or Activate enrollment
-            # Check if already enrolled to return False (for tool feedback)
-            cursor.execute("SELECT status FROM user_courses WHERE user_id = ? AND course_id = ?", (user_id, db_course_id))
-            curr = cursor.fetchone()
-            if curr and curr[0] == 'active':
-                return False
-
+            # No row comes back when the user is already actively enrolled (False for tool feedback)
             cursor.execute("""
                 INSERT INTO user_courses (user_id, course_id, status)
                 VALUES (?, ?, 'active')
                 ON CONFLICT(user_id, course_id) DO UPDATE SET status = 'active'
+                WHERE user_courses.status != 'active'
+                RETURNING status
             """, (user_id, db_course_id))
-            
+            enrolled = cursor.fetchone() is not None
             conn.commit()
+            # Remember the registry row only once the upsert that produced it has committed
+            if known is None:
+                self._course_rows[course_code] = (course_name, credits, db_course_id)
+            if not enrolled:
+                return False
+            self.academic_version += 1
             return True
 
     def unenroll_from_course(self, user_id: int, course_id: int) -> bool:
         """Drop a course (unenroll)."""
         try:
-            with sqlite3.connect(self.main_db, timeout=30.0) as conn:
+            with self._connect(self.main_db, write=True) as conn:
                 cursor = conn.cursor()
                 # Try by ID first
                 cursor.execute("""
@@ -258,6 +480,7 @@ class DatabaseManager:
                 """, (user_id, course_id))
                 if cursor.rowcount > 0:
                     conn.commit()
+                    self.academic_version += 1
                     return True
                 
                 # If failed, it might be the Course Catalogue ID vs Database ID mismatch
@@ -268,192 +491,318 @@ class DatabaseManager:
                 """, (user_id, course_id))
                 
                 conn.commit()
+                if cursor.rowcount > 0:
+                    self.academic_version += 1
                 return cursor.rowcount > 0
         except Exception:
             return False
 
     def add_schedule_event(self, event: ScheduleEvent, user_id: int) -> bool:
         """Adds a new event to the calendar, preventing duplicates."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
-            
-            # 1. Idempotency Check: Don't add if the same user has the same title at the same time
+            # Idempotency: uq_sched_hash turns a same-title, same-start event into a no-op
             cursor.execute("""
-                SELECT id FROM user_schedule 
-                WHERE user_id = ? AND title = ? AND start_datetime = ?
-            """, (user_id, event.title, event.start_datetime))
-            
-            if cursor.fetchone():
+                INSERT INTO user_schedule (user_id, title, start_datetime, end_datetime, priority, category, description, source, dedup_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, dedup_hash) DO NOTHING
+                RETURNING id
+            """, (user_id, event.title, event.start_datetime, event.end_datetime, event.priority, event.category, event.description, event.source,
+                  _event_fingerprint(event.title, event.start_datetime)))
+            row = cursor.fetchone()
+            if row is None:
                 print(f"DEBUG: Skipping duplicate event: '{event.title}' at {event.start_datetime}")
                 return False
-
-            # 2. Add New Event
-            cursor.execute("""
-                INSERT INTO user_schedule (user_id, title, start_datetime, end_datetime, priority, category, description, source)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, event.title, event.start_datetime, event.end_datetime, event.priority, event.category, event.description, event.source))
             conn.commit()
-            print(f"DEBUG: Event added successfully. ID: {cursor.lastrowid}")
+            self.schedule_version += 1
+            print(f"DEBUG: Event added successfully. ID: {row[0]}")
             return True
 
+    def add_schedule_events(self, events: List[ScheduleEvent], user_id: int) -> List[bool]:
+        """Adds several events in a single transaction, skipping duplicates. Returns a per-event added flag."""
+        with self._connect(self.secondary_db, write=True) as conn:
+            cursor = conn.cursor()
+            added = []
+            # One statement per event: duplicates (in the table or earlier in this batch) hit the unique index
+            for event in events:
+                cursor.execute("""
+                    INSERT INTO user_schedule (user_id, title, start_datetime, end_datetime, priority, category, description, source, dedup_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, dedup_hash) DO NOTHING
+                """, (user_id, event.title, event.start_datetime, event.end_datetime, event.priority, event.category, event.description, event.source,
+                      _event_fingerprint(event.title, event.start_datetime)))
+                added.append(cursor.rowcount > 0)
+            conn.commit()
+            if any(added):
+                self.schedule_version += 1
+            print(f"DEBUG: Bulk added {sum(added)} of {len(events)} events")
+            return added
+
     def get_upcoming_events(self, user_id: int, limit: int = 50) -> List[dict]:
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connect(self.secondary_db) as conn:
             cursor = conn.cursor()
             # Show events starting most recently or in the future first
-            cursor.execute("SELECT * FROM user_schedule WHERE user_id = ? ORDER BY start_datetime DESC LIMIT ?", (user_id, limit))
-            return [dict(row) for row in cursor.fetchall()]
+            cursor.execute(f"SELECT {EVENT_COLUMNS} FROM user_schedule WHERE user_id = ? ORDER BY start_datetime DESC LIMIT ?", (user_id, limit))
+            return _fetch_dicts(cursor)
 
     def get_events_by_range(self, user_id: int, start_date: str, end_date: str) -> List[dict]:
         """Get events strictly between two dates (inclusive)."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connect(self.secondary_db) as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM user_schedule 
+            cursor.execute(f"""
+                SELECT {EVENT_COLUMNS} FROM user_schedule 
                 WHERE user_id = ? AND ((start_datetime BETWEEN ? AND ?) OR (end_datetime BETWEEN ? AND ?))
                 ORDER BY start_datetime ASC
             """, (user_id, start_date, end_date, start_date, end_date))
-            return [dict(row) for row in cursor.fetchall()]
+            return _fetch_dicts(cursor)
 
     def search_events(self, user_id: int, query: str = None, date: str = None) -> List[dict]:
         """Search events by title keyword or specific date."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connect(self.secondary_db) as conn:
             cursor = conn.cursor()
             if date:
                 # Search by date (YYYY-MM-DD prefix)
-                cursor.execute("SELECT * FROM user_schedule WHERE user_id = ? AND start_datetime LIKE ? ORDER BY start_datetime ASC", (user_id, f"{date}%"))
+                cursor.execute(
+                    f"SELECT {EVENT_COLUMNS} FROM user_schedule WHERE user_id = ? AND start_datetime >= ? AND start_datetime < ? ORDER BY start_datetime ASC",
+                    (user_id, *_prefix_bounds(date))
+                )
             elif query:
                 # Search by keyword
-                cursor.execute("SELECT * FROM user_schedule WHERE user_id = ? AND (title LIKE ? OR description LIKE ?) ORDER BY start_datetime ASC", (user_id, f"%{query}%", f"%{query}%"))
+                cursor.execute(f"SELECT {EVENT_COLUMNS} FROM user_schedule WHERE user_id = ? AND (title LIKE ? OR description LIKE ?) ORDER BY start_datetime ASC", (user_id, f"%{query}%", f"%{query}%"))
             else:
                 return self.get_upcoming_events(user_id)
-            return [dict(row) for row in cursor.fetchall()]
+            return _fetch_dicts(cursor)
 
     def update_event(self, event_id: int, user_id: int, updates: dict) -> bool:
-        """Update specific fields of an event."""
-        if not updates: return False
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        """Update specific fields of an event. Keys outside EVENT_UPDATE_FIELDS are ignored."""
+        # Canonical column order gives one SQL text per field set, whatever order the dict arrived in
+        fields = tuple(f for f in EVENT_UPDATE_FIELDS if f in updates)
+        if not fields: return False
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
-            fields = ", ".join([f"{k} = ?" for k in updates.keys()])
-            values = list(updates.values())
+            values = [updates[f] for f in fields]
             values.extend([event_id, user_id])
-            cursor.execute(f"UPDATE user_schedule SET {fields} WHERE id = ? AND user_id = ?", values)
+            try:
+                cursor.execute(_update_sql("user_schedule", fields, "id = ? AND user_id = ?"), values)
+                if "title" in fields or "start_datetime" in fields:
+                    # The SET above has already applied, so the fingerprint is computed from the new values
+                    cursor.execute(
+                        "UPDATE user_schedule SET dedup_hash = event_fingerprint(title, start_datetime) WHERE id = ? AND user_id = ?",
+                        (event_id, user_id)
+                    )
+            except sqlite3.IntegrityError:
+                # Would duplicate another event's title and start time; undo the field update too
+                conn.rollback()
+                return False
             conn.commit()
+            self.schedule_version += 1
             return cursor.rowcount > 0
 
     def delete_event(self, event_id: int, user_id: int) -> bool:
         """Delete an event by ID."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM user_schedule WHERE id = ? AND user_id = ?", (event_id, user_id))
+            if not cursor.rowcount:
+                # Nothing deleted: roll back rather than commit, and keep schedule caches valid
+                conn.rollback()
+                return False
             conn.commit()
-            return cursor.rowcount > 0
+            self.schedule_version += 1
+            return True
 
     def delete_events_by_date(self, date: str, user_id: int) -> int:
         """Delete all events starting on a specific date (YYYY-MM-DD)."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        return self.delete_events_by_dates([date], user_id)
+
+    def delete_events_by_dates(self, dates: List[str], user_id: int) -> int:
+        """Delete all events starting on any of the given dates in one transaction. Returns the number removed."""
+        dates = [d for d in dates if d]
+        if not dates:
+            return 0
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
-            cursor.execute("DELETE FROM user_schedule WHERE user_id = ? AND start_datetime LIKE ?", (user_id, f"{date}%"))
+            cursor.executemany(
+                "DELETE FROM user_schedule WHERE user_id = ? AND start_datetime >= ? AND start_datetime < ?",
+                [(user_id, *_prefix_bounds(d)) for d in dates]
+            )
+            if not cursor.rowcount:
+                conn.rollback()
+                return 0
             conn.commit()
+            self.schedule_version += 1
             return cursor.rowcount
 
     def clear_all_events(self, user_id: int) -> int:
         """Delete every event in the database for a user."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM user_schedule WHERE user_id = ?", (user_id,))
+            if not cursor.rowcount:
+                conn.rollback()
+                return 0
             conn.commit()
+            self.schedule_version += 1
             return cursor.rowcount
 
     # =========================================================================
     # CHAT HISTORY METHODS
     # =========================================================================
 
+    def _append_cached_messages(self, user_id: int, thread_id: str, rows: List[dict]):
+        """Extends a cached thread with freshly written rows, dropping it once it outgrows the cache."""
+        key = (user_id, thread_id)
+        with self._thread_cache_lock:
+            self._chat_version += 1
+            cached = self._thread_cache.get(key)
+            if cached is None:
+                return
+            if len(cached) + len(rows) > CHAT_CACHE_MESSAGES:
+                del self._thread_cache[key]
+                return
+            cached.extend(rows)
+            self._thread_cache.move_to_end(key)
+
+    @staticmethod
+    def _insert_message(conn, user_id: int, thread_id: str, role: str, message: str, intent: str, timestamp: str) -> dict:
+        # The timestamp is written explicitly (same format as CURRENT_TIMESTAMP) so the cached row matches the stored one
+        cursor = conn.execute("""
+            INSERT INTO chat_history (user_id, thread_id, role, message, intent, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, thread_id, role, message, intent, timestamp))
+        return {
+            "id": cursor.lastrowid, "user_id": user_id, "thread_id": thread_id,
+            "role": role, "message": message, "intent": intent, "timestamp": timestamp
+        }
+
     def save_message(self, user_id: int, thread_id: str, role: str, message: str, intent: str = None):
         """Save a chat message (user or assistant)."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-            INSERT INTO chat_history (user_id, thread_id, role, message, intent)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, thread_id, role, message, intent))
-            conn.commit()
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self._connect(self.secondary_db, write=True) as conn:
+            row = self._insert_message(conn, user_id, thread_id, role, message, intent, timestamp)
+        self._append_cached_messages(user_id, thread_id, [row])
+
+    def save_message_pair(self, user_id: int, thread_id: str, user_message: str, assistant_message: str, intent: str = None):
+        """Save a user turn and the assistant reply in a single transaction."""
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self._connect(self.secondary_db, write=True) as conn:
+            rows = [
+                self._insert_message(conn, user_id, thread_id, "user", user_message, None, timestamp),
+                self._insert_message(conn, user_id, thread_id, "assistant", assistant_message, intent, timestamp)
+            ]
+        self._append_cached_messages(user_id, thread_id, rows)
 
     def delete_chat_thread(self, user_id: int, thread_id: str) -> bool:
-        """Deletes all chat messages and schedule items associated with a thread."""
+        """Deletes all chat messages and schedule items associated with a thread, atomically."""
         try:
-            # Delete messages from chat history
-            with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
+            with self._connect(self.secondary_db, write=True) as conn:
+                # Delete messages from chat history
+                conn.execute("""
                     DELETE FROM chat_history 
                     WHERE user_id = ? AND thread_id = ?
                 """, (user_id, thread_id))
-                conn.commit()
-            
-            # Delete items from scheduler if they came from this thread (source tracking)
-            with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
+                # Delete items from scheduler if they came from this thread (source tracking)
+                conn.execute("""
                     DELETE FROM user_schedule 
                     WHERE user_id = ? AND source = ?
                 """, (user_id, thread_id))
-                conn.commit()
-                
+            with self._thread_cache_lock:
+                self._chat_version += 1
+                self._thread_cache.pop((user_id, thread_id), None)
+            self.schedule_version += 1
+            # Drop the thread's in-memory graph checkpoints too, so deleted threads stop holding RAM
+            checkpointer.delete_thread(thread_id)
             return True
         except Exception as e:
             print(f"Error deleting thread: {e}")
             return False
 
-    def get_chat_history(self, user_id: int, thread_id: str = None, limit: int = 100) -> List[dict]:
+    def get_chat_history(self, user_id: int, thread_id: str = None, limit: int = 100, before_id: int = None) -> List[dict]:
         """
         Get chat history for a user.
+        Single-thread reads are served from the in-memory thread cache when possible.
+        before_id pages backwards: pass the oldest message id of the previous page to get the
+        `limit` messages just before it (an index seek, unlike OFFSET).
         """
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-            conn.row_factory = sqlite3.Row
+        if thread_id:
+            key = (user_id, thread_id)
+            with self._thread_cache_lock:
+                cached = self._thread_cache.get(key)
+                if cached is not None:
+                    self._thread_cache.move_to_end(key)
+                    if before_id is not None:
+                        return [dict(row) for row in cached if row["id"] < before_id][-limit:]
+                    return [dict(row) for row in cached[:limit]]
+                version = self._chat_version
+
+        with self._connect(self.secondary_db) as conn:
             cursor = conn.cursor()
             
+            if thread_id and before_id is not None:
+                # Newest `limit` messages older than the cursor, returned oldest-first like a full thread read
+                cursor.execute("""
+                    SELECT id, user_id, thread_id, role, message, intent, timestamp
+                    FROM chat_history 
+                    WHERE user_id = ? AND thread_id = ? AND id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                """, (user_id, thread_id, before_id, limit))
+                return _fetch_dicts(cursor)[::-1]
+            
             if thread_id:
+                # Fetch the whole thread (up to the cache cap) so it can be cached, then apply the limit
                 cursor.execute("""
                     SELECT id, user_id, thread_id, role, message, intent, timestamp
                     FROM chat_history 
                     WHERE user_id = ? AND thread_id = ?
                     ORDER BY timestamp ASC
                     LIMIT ?
-                """, (user_id, thread_id, limit))
-            else:
+                """, (user_id, thread_id, max(limit, CHAT_CACHE_MESSAGES + 1)))
+                rows = _fetch_dicts(cursor)
+                if len(rows) <= CHAT_CACHE_MESSAGES:
+                    with self._thread_cache_lock:
+                        # Skip caching if a write landed while we were reading
+                        if version == self._chat_version:
+                            self._thread_cache[key] = [dict(row) for row in rows]
+                            while len(self._thread_cache) > CHAT_CACHE_THREADS:
+                                self._thread_cache.popitem(last=False)
+                return rows[:limit]
+            
+            if before_id is not None:
                 cursor.execute("""
                     SELECT id, user_id, thread_id, role, message, intent, timestamp
                     FROM chat_history 
-                    WHERE user_id = ?
-                    ORDER BY timestamp DESC
+                    WHERE user_id = ? AND id < ?
+                    ORDER BY id DESC
                     LIMIT ?
-                """, (user_id, limit))
+                """, (user_id, before_id, limit))
+                return _fetch_dicts(cursor)
+            
+            cursor.execute("""
+                SELECT id, user_id, thread_id, role, message, intent, timestamp
+                FROM chat_history 
+                WHERE user_id = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            """, (user_id, limit))
             
-            return [dict(row) for row in cursor.fetchall()]
+            return _fetch_dicts(cursor)
 
     def get_user_threads(self, user_id: int) -> List[dict]:
         """Get all conversation threads for a user with their last message."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connect(self.secondary_db) as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT thread_id, 
-                       MAX(timestamp) as last_message_time,
-                       COUNT(*) as message_count
-                FROM chat_history 
+                SELECT thread_id, last_message_time, message_count
+                FROM chat_threads
                 WHERE user_id = ?
-                GROUP BY thread_id
                 ORDER BY last_message_time DESC
             """, (user_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            return _fetch_dicts(cursor)
 
     def get_todos(self, user_id: int) -> List[dict]:
         """Fetch all todo items for a specific user."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connect(self.secondary_db) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT id, user_id, text, completed, due_date, priority, tag, created_at
@@ -461,11 +810,11 @@ class DatabaseManager:
                 WHERE user_id = ?
                 ORDER BY created_at DESC
             """, (user_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            return _fetch_dicts(cursor)
 
     def add_todo(self, user_id: int, text: str, due_date: str = None, priority: str = "Medium", tag: str = "General") -> int:
         """Add a new todo item."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO todo_items (user_id, text, due_date, priority, tag)
@@ -479,44 +828,73 @@ class DatabaseManager:
         updates = []
         params = []
         if completed is not None:
-            updates.append("completed = ?")
+            updates.append("completed")
             params.append(1 if completed else 0)
         if text is not None:
-            updates.append("text = ?")
+            updates.append("text")
             params.append(text)
         
         if not updates:
             return False
             
         params.append(todo_id)
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
-            cursor.execute(f"""
-                UPDATE todo_items 
-                SET {", ".join(updates)}
-                WHERE id = ?
-            """, params)
+            cursor.execute(_update_sql("todo_items", tuple(updates), "id = ?"), params)
             conn.commit()
             return cursor.rowcount > 0
 
     def delete_todo(self, todo_id: int) -> bool:
         """Delete a todo item."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM todo_items WHERE id = ?", (todo_id,))
+            if not cursor.rowcount:
+                conn.rollback()
+                return False
             conn.commit()
-            return cursor.rowcount > 0
+            return True
 
     def clear_all_todos(self, user_id: int) -> bool:
         """Remove all todos for a user."""
-        with sqlite3.connect(self.secondary_db, timeout=30.0) as conn:
+        with self._connect(self.secondary_db, write=True) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM todo_items WHERE user_id = ?", (user_id,))
+            if not cursor.rowcount:
+                conn.rollback()
+                return False
             conn.commit()
-            return cursor.rowcount > 0
+            return True
 
+    # =========================================================================
+    # INGESTED DOCUMENT METHODS
+    # =========================================================================
+
+    def get_ingested_hashes(self, user_id: str, file_hashes: List[str]) -> set:
+        """Return the subset of file_hashes already ingested for a user."""
+        if not file_hashes:
+            return set()
+        with self._connect(self.secondary_db) as conn:
+            placeholders = ", ".join("?" * len(file_hashes))
+            cursor = conn.execute(
+                f"SELECT file_hash FROM ingested_documents WHERE user_id = ? AND file_hash IN ({placeholders})",
+                (user_id, *file_hashes)
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def record_ingested_documents(self, user_id: str, documents: List[tuple]):
+        """Record (file_hash, path) pairs as ingested for a user."""
+        with self._connect(self.secondary_db, write=True) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ingested_documents (file_hash, user_id, path) VALUES (?, ?, ?)",
+                [(file_hash, user_id, path) for file_hash, path in documents]
+            )
+
+    def forget_ingested_documents(self, user_id: str):
+        """Drop a user's ingestion records, e.g. after their vectors are deleted."""
+        with self._connect(self.secondary_db, write=True) as conn:
+            conn.execute("DELETE FROM ingested_documents WHERE user_id = ?", (user_id,))
 
-from langgraph.checkpoint.memory import MemorySaver
 
 # Global Database Manager
 db_manager = DatabaseManager()
@@ -524,4 +902,5 @@ db_manager = DatabaseManager()
 # Graph Persistence
 # Using MemorySaver for stability with real-time streaming (astream_events).
 # Note: Threads will be transient until persistent async checkpointer is stabilized.
+# The sync SqliteSaver can't serve the async graph APIs, so checkpoints are instead freed with their thread.
 checkpointer = MemorySaver()
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+import numpy as np
+from database import DATA_DIR, CONNECTION_PRAGMAS
+
+EMBED_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache.db")
+# Oldest vectors are dropped beyond this many rows (~1.6 KB each for 384-dim float32)
+EMBED_CACHE_MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", "500000"))
+# SQLite's default bound-parameter limit is 999 on older builds
+_LOOKUP_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    On-disk text -> vector cache so re-ingesting an unchanged document doesn't re-embed its chunks.
+    Keys are BLAKE2b digests of the model id and the text, so switching models never serves stale vectors.
+    """
+
+    def __init__(self, model_id: str, path: str = EMBED_CACHE_PATH, max_rows: int = EMBED_CACHE_MAX_ROWS):
+        self.model_id = model_id.encode()
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            self._conn.execute(pragma)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _key(self, text: str) -> bytes:
+        digest = hashlib.blake2b(self.model_id, digest_size=16)
+        digest.update(b"\0")
+        digest.update(text.encode())
+        return digest.digest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors in input order, None where the text hasn't been embedded yet."""
+        keys = [self._key(t) for t in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                found.update(rows)
+        return [
+            np.frombuffer(found[k], dtype=np.float32).tolist() if k in found else None
+            for k in keys
+        ]
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        rows = [
+            (self._key(t), np.asarray(v, dtype=np.float32).tobytes())
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            # rowid grows with insertion order, so the smallest rowids are the oldest entries
+            self._conn.execute("""
+                DELETE FROM embeddings WHERE rowid <= (
+                    SELECT MAX(rowid) FROM embeddings
+                ) - ?
+            """, (self.max_rows,))
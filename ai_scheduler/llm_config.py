@@ -1,5 +1,8 @@
 from dotenv import load_dotenv
 import os
+import re
+import logging
+from functools import lru_cache
 
 # Load from absolute path to be safe
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -8,8 +11,13 @@ load_dotenv(os.path.join(PARENT_DIR, ".env.local"))
 load_dotenv(os.path.join(PARENT_DIR, ".env"))
 load_dotenv() # Final fallback to local .env
 
-from langchain_openai import ChatOpenAI
-from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
+# One root handler for the backend; LOG_LEVEL=WARNING quiets per-file ingest logs in production
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+# langchain_huggingface pulls in torch and transformers, so it is imported inside the factories below
 from utils import (
     get_current_date, list_calendar_events, search_calendar, add_event, 
     delete_calendar_event, delete_events_on_date, update_calendar_event, 
@@ -19,6 +27,7 @@ from utils import (
 )
 
 
+# from langchain_openai import ChatOpenAI
 # llm = ChatOpenAI(
 #     model = "openai/gpt-oss-120b",
 #     base_url = "https://openrouter.ai/api/v1",
@@ -26,12 +35,17 @@ from utils import (
 #     max_tokens = 512,
 #     temperature = 0.1
 # )
-temp_llm = HuggingFaceEndpoint(
-    repo_id="openai/gpt-oss-120b",
-    task="text-generation",
-    temperature=0.1
-)
-llm = ChatHuggingFace(llm=temp_llm)
+
+@lru_cache(maxsize=1)
+def get_llm():
+    """The base chat model, built once on first use and shared by every agent."""
+    from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
+    temp_llm = HuggingFaceEndpoint(
+        repo_id="openai/gpt-oss-120b",
+        task="text-generation",
+        temperature=0.1
+    )
+    return ChatHuggingFace(llm=temp_llm)
 
 # Tools list
 tools = [
@@ -42,15 +56,102 @@ tools = [
     unenroll_student_from_course, get_my_enrolled_courses
 ]
 
+def stream_invoke(model, model_input):
+    """
+    Streams a completion and returns the merged message, so token events reach
+    astream_events consumers while the caller still gets a full AIMessage
+    (including any tool calls).
+    """
+    response = None
+    for chunk in model.stream(model_input):
+        response = chunk if response is None else response + chunk
+    return response
+
+def content_to_str(content) -> str:
+    """Normalizes message content (a string or a list of content blocks) to plain text."""
+    if content.__class__ is str:
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block if isinstance(block, str) else block.get("text", "")
+            for block in content
+            if isinstance(block, (str, dict))
+        )
+    return str(content)
+
+_JSON_FENCE_RE = re.compile(r"```json\s*(.*?)\s*```", re.DOTALL)
+
+def extract_json(content: str) -> str:
+    """Returns the JSON payload of an LLM reply: a fenced ```json block first, then the outermost { ... }."""
+    match = _JSON_FENCE_RE.search(content)
+    if match:
+        return match.group(1)
+    start, end = content.find("{"), content.rfind("}")
+    return content[start:end + 1] if start != -1 and end > start else content
+
 orchestrator_tools = [get_current_date]
-orchestrator_llm = llm.bind_tools(orchestrator_tools)
-verifier_llm = llm
-chat_llm = llm
 
-# Capable LLM for RAG and Scheduler
-rag_llm = llm
-scheduler_llm = llm.bind_tools(tools)
+@lru_cache(maxsize=1)
+def get_orchestrator_llm():
+    return get_llm().bind_tools(orchestrator_tools)
+
+@lru_cache(maxsize=1)
+def get_scheduler_llm():
+    # Capable LLM for the Scheduler, with the full tool set bound once
+    return get_llm().bind_tools(tools)
+
+# Model handles are resolved on first access (PEP 562), so importing this module builds nothing
+# and every importer gets the same instances. verifier, chat and rag all use the base model.
+_LAZY_MODELS = {
+    "llm": get_llm,
+    "chat_llm": get_llm,
+    "verifier_llm": get_llm,
+    "rag_llm": get_llm,
+    "orchestrator_llm": get_orchestrator_llm,
+    "scheduler_llm": get_scheduler_llm,
+}
+
+def __getattr__(name):
+    factory = _LAZY_MODELS.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return factory()
 
 # Embeddings
-from langchain_huggingface import HuggingFaceEmbeddings
-embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
\ No newline at end of file
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+# "torch" by default; "onnx" runs the model on ONNX Runtime (roughly 2x CPU throughput, needs optimum[onnxruntime])
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+@lru_cache(maxsize=1)
+def _embedding_model_kwargs() -> dict:
+    """Backend, device and dtype the embedding model is loaded with on this host."""
+    import torch
+    model_kwargs = {"backend": EMBEDDINGS_BACKEND} if EMBEDDINGS_BACKEND != "torch" else {}
+    model_kwargs["device"] = "cuda" if torch.cuda.is_available() else "cpu"
+    if model_kwargs["device"] == "cuda" and EMBEDDINGS_BACKEND == "torch":
+        # Half-precision weights halve memory traffic and run on tensor cores
+        model_kwargs["model_kwargs"] = {"torch_dtype": torch.float16}
+    return model_kwargs
+
+def get_embedding_model_id() -> str:
+    """
+    Identifies the vectors get_embeddings() produces: model, backend, device and dtype.
+    fp16 CUDA and fp32 CPU outputs differ slightly, so caches keyed on this never mix them.
+    """
+    model_kwargs = _embedding_model_kwargs()
+    dtype = "float16" if "model_kwargs" in model_kwargs else "float32"
+    return f"{EMBEDDING_MODEL}|{EMBEDDINGS_BACKEND}|{model_kwargs['device']}|{dtype}"
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """The process-wide embedding model; every agent and the vector store share this one instance."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs=_embedding_model_kwargs(),
+        # Unit-length vectors: cosine scores in Pinecone are unchanged, and callers can use plain dot products
+        encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE, "normalize_embeddings": True}
+    )
+
+_LAZY_MODELS["embeddings"] = get_embeddings
\ No newline at end of file
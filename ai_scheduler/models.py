@@ -1,6 +1,6 @@
-from typing import List, Optional, Literal, Annotated, TypedDict
+from typing import Any, Dict, List, Optional, Literal, Annotated, TypedDict, get_args
 from enum import Enum
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from langgraph.graph.message import add_messages
 
 class AgentType(str, Enum):
@@ -12,6 +12,11 @@ class AgentType(str, Enum):
     ACADEMIC = "academic"
 
 
+EventPriority = Literal["High", "Medium", "Low"]
+# Allowed priorities as a frozenset, for membership checks outside Pydantic validation
+EVENT_PRIORITIES = frozenset(get_args(EventPriority))
+
+
 class CourseGrade(BaseModel):
     """Individual course grade info"""
     course_code: str
@@ -47,9 +52,12 @@ class GPAStrategyOutput(BaseModel):
 
 class OrchestratorOutput(BaseModel):
     """Structured output from Orchestrator Agent"""
+    # Keep intent as the plain string: it is routed on and dumped as a string anyway
+    model_config = ConfigDict(use_enum_values=True)
+
     intent: AgentType = Field(description="The detected intent/agent to route to")
     confidence: float = Field(ge=0.0, le=1.0, description="Confidence score for routing decision")
-    extracted_entities: dict = Field(default_factory=dict, description="Extracted entities from user query")
+    extracted_entities: Dict[str, Any] = Field(default_factory=dict, description="Extracted entities from user query")
     query_summary: str = Field(description="Summarized/cleaned version of user query")
     requires_context: bool = Field(default=False, description="Whether RAG context is needed")
     reasoning: str = Field(description="Brief reasoning for the routing decision")
@@ -78,7 +86,7 @@ class RAGOutput(BaseModel):
     extracted_timetable: List[dict] = Field(default_factory=list, description="Extracted recurring class/timetable information")
     extracted_events: List[dict] = Field(default_factory=list, description="Extracted one-time event information")
     # Internal fields populated by agent, not LLM
-    retrieved_chunks: Optional[List[str]] = Field(default=None, description="Retrieved document chunks")
+    retrieved_chunks: Optional[List[str]] = Field(default=None, description="Retrieved document chunks (not carried in graph state)")
     relevance_scores: Optional[List[float]] = Field(default=None, description="Relevance scores for chunks")
     source_documents: Optional[List[str]] = Field(default=None, description="Source document names")
 
@@ -88,7 +96,7 @@ class ScheduleEvent(BaseModel):
     title: str = Field(description="Event title")
     start_datetime: str = Field(description="Start datetime in ISO format")
     end_datetime: str = Field(description="End datetime in ISO format")
-    priority: Literal["High", "Medium", "Low"] = Field(default="Medium")
+    priority: EventPriority = Field(default="Medium")
     category: str = Field(default="General", description="Event category (Study, Assignment, Exam, etc.)")
     description: str = Field(default="", description="Event description")
     source: str = Field(default="user", description="Source of the event (user, syllabus, etc.)")
@@ -128,7 +136,7 @@ class CurrentState(BaseModel):
     existing_events: List[dict] = Field(default_factory=list, description="Current calendar events")
     active_tasks: List[dict] = Field(default_factory=list, description="Active tasks/assignments")
     academic_history: AcademicHistory = Field(default_factory=AcademicHistory)
-    user_preferences: dict = Field(default_factory=dict, description="User scheduling preferences")
+    user_preferences: Dict[str, Any] = Field(default_factory=dict, description="User scheduling preferences")
     last_updated: str = Field(default="", description="Last update timestamp")
 
 
@@ -137,13 +145,13 @@ class MultiAgentState(TypedDict):
     messages: Annotated[list, add_messages]
     user_query: str
     user_id: str  # For multi-tenant document isolation
-    orchestrator_output: Optional[dict]
-    rag_output: Optional[dict]
-    scheduler_output: Optional[dict]
-    verifier_output: Optional[dict]
-    chat_output: Optional[dict]
-    academic_output: Optional[dict]
-    current_state: Optional[dict]
+    orchestrator_output: Optional[Dict[str, Any]]
+    rag_output: Optional[Dict[str, Any]]
+    scheduler_output: Optional[Dict[str, Any]]
+    verifier_output: Optional[Dict[str, Any]]
+    chat_output: Optional[Dict[str, Any]]
+    academic_output: Optional[Dict[str, Any]]
+    current_state: Optional[Dict[str, Any]]
     pdf_paths: List[str]
     final_response: str
     error: Optional[str]
@@ -1,19 +1,92 @@
 import os
-from typing import List, Optional
+import uuid
+import asyncio
+import hashlib
+import itertools
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
 from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_pinecone import PineconeVectorStore
 from langchain_core.documents import Document
 from pinecone import Pinecone, ServerlessSpec
+try:
+    # Optional pinecone[grpc] extra: upserts over gRPC with native async futures
+    from pinecone.grpc import PineconeGRPC
+except ImportError:
+    PineconeGRPC = None
 from pptx import Presentation
-from llm_config import embeddings
+from llm_config import embeddings, get_embedding_model_id
+from database import db_manager
+from embed_cache import EmbeddingCache
+from semantic_cache import SemanticLRU, needs_exact_match, normalize_query, unit_embedding
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Supported file extensions
 SUPPORTED_EXTENSIONS = {'.pdf', '.ppt', '.pptx'}
 
+HASH_CHUNK_SIZE = 1024 * 1024
+# Pinecone upserts are network-bound: send batches of this size, several requests in flight at once
+UPSERT_BATCH_SIZE = 100
+UPSERT_CONCURRENCY = 8
+LOAD_CONCURRENCY = 8
+# Chunks are sized in tokens, not characters. all-MiniLM-L6-v2 truncates input past 256 word pieces
+# (roughly 200 o200k tokens of English), so larger chunks would lose their tail from the embedding.
+SPLITTER_ENCODING = "o200k_base"
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 40
+# Chunks embedded and upserted per step while streaming an upload
+INGEST_BATCH_CHUNKS = 256
+
+
+def _file_hash(path: str) -> str:
+    """128-bit BLAKE2b digest of a file's contents, read in 1 MiB chunks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RetrievalCache:
+    """
+    Cache of similarity-search results with a TTL, scoped per user and k.
+    Exact repeats of a normalized query are answered without embedding; otherwise a query whose
+    embedding is close enough to a cached one reuses that query's results. Queries naming a number
+    or date (e.g. "CS101 midterm" vs "CS102 midterm") only ever match an exact repeat.
+    """
+
+    def __init__(self, max_size: int = 4096, threshold: float = 0.97, ttl: float = 600.0):
+        self._lru = SemanticLRU(max_size, threshold, ttl)  # (user_id, normalized query, k) -> results
+
+    def lookup_exact(self, user_id: str, query: str, k: int):
+        cached = self._lru.get((user_id, normalize_query(query), k))
+        return list(cached) if cached is not None else None
+
+    def lookup_similar(self, user_id: str, query: str, vec: np.ndarray, k: int):
+        if needs_exact_match(query):
+            vec = None  # Counted as a miss; the exact tier already had its chance
+        cached = self._lru.nearest(vec, where=lambda key: key[0] == user_id and key[2] == k)
+        return list(cached) if cached is not None else None
+
+    def store(self, user_id: str, query: str, k: int, vec: np.ndarray, results: list):
+        # Token-bearing queries are stored without a vector so they can't answer a different query
+        self._lru.put((user_id, normalize_query(query), k), None if needs_exact_match(query) else vec, list(results))
+
+    def invalidate(self, user_id: str):
+        self._lru.discard(lambda key: key[0] == user_id)
+
+    def stats(self) -> dict:
+        stats = self._lru.stats()
+        stats["users"] = len({key[0] for key in self._lru.keys()})
+        return stats
+
 
 class PowerPointLoader:
     """Custom loader for PowerPoint files using python-pptx."""
@@ -23,32 +96,33 @@ class PowerPointLoader:
     
     def load(self) -> List[Document]:
         """Load and parse PowerPoint file into LangChain Documents."""
-        documents = []
-        
+        return list(self.lazy_load())
+    
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield one Document per non-empty slide, so callers can process large decks slide by slide."""
         try:
             prs = Presentation(self.file_path)
             
             for slide_num, slide in enumerate(prs.slides, start=1):
                 slide_content = []
                 
-                # Extract text from all shapes
+                # Extract text from all shapes, stripping each shape's text once
                 for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text.strip():
-                        slide_content.append(shape.text.strip())
+                    text = getattr(shape, "text", "").strip()
+                    if text:
+                        slide_content.append(text)
                     
                     # Handle tables
                     if shape.has_table:
-                        table = shape.table
-                        for row in table.rows:
-                            row_text = " | ".join(
-                                cell.text.strip() for cell in row.cells if cell.text.strip()
-                            )
+                        for row in shape.table.rows:
+                            row_text = " | ".join(filter(None, [cell.text.strip() for cell in row.cells]))
                             if row_text:
                                 slide_content.append(row_text)
                 
                 # Extract notes if available
-                if slide.has_notes_slide and slide.notes_slide.notes_text_frame:
-                    notes = slide.notes_slide.notes_text_frame.text.strip()
+                if slide.has_notes_slide:
+                    notes_frame = slide.notes_slide.notes_text_frame
+                    notes = notes_frame.text.strip() if notes_frame else ""
                     if notes:
                         slide_content.append(f"[Speaker Notes: {notes}]")
                 
@@ -62,13 +136,10 @@ class PowerPointLoader:
                             "file_type": "pptx"
                         }
                     )
-                    documents.append(doc)
-            
-            return documents
+                    yield doc
             
         except Exception as e:
-            print(f"Error loading PowerPoint file {self.file_path}: {e}")
-            return []
+            logger.warning("Error loading PowerPoint file %s: %s", self.file_path, e)
 
 
 class VectorStoreManager:
@@ -77,9 +148,13 @@ class VectorStoreManager:
     def __init__(self, index_name: str = "ched-scheduler"):
         self.index_name = index_name
         self.vector_store: Optional[PineconeVectorStore] = None
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=150,
+        self.retrieval_cache = RetrievalCache()
+        # Keyed on model, backend, device and dtype: fp16 CUDA, fp32 CPU and ONNX vectors differ slightly
+        self.embed_cache = EmbeddingCache(get_embedding_model_id())
+        self.text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=SPLITTER_ENCODING,
+            chunk_size=CHUNK_TOKENS,
+            chunk_overlap=CHUNK_OVERLAP_TOKENS,
             separators=["\n\n", "\n", ". ", " ", ""]
         )
         
@@ -89,6 +164,7 @@ class VectorStoreManager:
             raise ValueError("PINECONE_API_KEY environment variable is not set.")
         
         self.pc = Pinecone(api_key=api_key)
+        self.pc_grpc = PineconeGRPC(api_key=api_key) if PineconeGRPC else None
         
         # Get or create the index
         self._ensure_index_exists()
@@ -98,7 +174,7 @@ class VectorStoreManager:
         existing_indexes = [idx.name for idx in self.pc.list_indexes()]
         
         if self.index_name not in existing_indexes:
-            print(f"Creating Pinecone index: {self.index_name}")
+            logger.info("Creating Pinecone index: %s", self.index_name)
             self.pc.create_index(
                 name=self.index_name,
                 dimension=384,  # all-MiniLM-L6-v2 produces 384-dim vectors
@@ -110,8 +186,11 @@ class VectorStoreManager:
             )
         
         # Connect to the index
+        self.index = self.pc.Index(self.index_name)
+        # Writes go over gRPC when available; PineconeVectorStore keeps the REST handle for queries
+        self.upsert_index = self.pc_grpc.Index(self.index_name) if self.pc_grpc else None
         self.vector_store = PineconeVectorStore(
-            index=self.pc.Index(self.index_name),
+            index=self.index,
             embedding=embeddings,
             text_key="text"
         )
@@ -125,7 +204,7 @@ class VectorStoreManager:
         elif ext in {'.ppt', '.pptx'}:
             return PowerPointLoader(file_path)
         else:
-            print(f"Unsupported file type: {ext}")
+            logger.warning("Unsupported file type: %s", ext)
             return None
     
     def load_document_text(self, file_path: str) -> str:
@@ -137,50 +216,171 @@ class VectorStoreManager:
             docs = loader.load()
             return "\n\n".join([d.page_content for d in docs])
         except Exception as e:
-            print(f"Direct load error: {e}")
+            logger.warning("Direct load error for %s: %s", file_path, e)
             return ""
 
     
+    def _iter_pages(self, path: str, user_id: str) -> Iterator[Document]:
+        """Lazily yield the pages/slides of one supported file, tagged with user metadata."""
+        if not os.path.exists(path):
+            logger.warning("File not found: %s", path)
+            return
+        
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in SUPPORTED_EXTENSIONS:
+            logger.warning("Unsupported file type: %s. Supported: %s", ext, SUPPORTED_EXTENSIONS)
+            return
+        
+        loader = self._get_loader(path)
+        if not loader:
+            return
+        count = 0
+        try:
+            for doc in loader.lazy_load():
+                # Add source and user metadata
+                doc.metadata["source_file"] = os.path.basename(path)
+                doc.metadata["user_id"] = user_id
+                doc.metadata["file_type"] = ext.replace('.', '')
+                count += 1
+                yield doc
+            logger.debug("Loaded %s (%d pages/slides)", path, count)
+        except Exception as e:
+            logger.warning("Error loading %s after %d pages/slides: %s", path, count, e)
+    
+    def _load_one(self, path: str, user_id: str) -> List[Document]:
+        """Load one supported file and tag its pages/slides with user metadata."""
+        return list(self._iter_pages(path, user_id))
+    
+    def _iter_chunk_batches(self, file_paths: List[str], user_id: str) -> Iterator[List[Document]]:
+        """
+        Stream files page by page through the splitter, yielding chunks in batches of INGEST_BATCH_CHUNKS.
+        The splitter works per page anyway, so the chunks match _load_chunks without holding every page at once.
+        """
+        batch = []
+        for path in file_paths:
+            for page in self._iter_pages(path, user_id):
+                batch.extend(self.text_splitter.split_documents([page]))
+                if len(batch) >= INGEST_BATCH_CHUNKS:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    
+    def _load_chunks(self, file_paths: List[str], user_id: str) -> List[Document]:
+        """Load supported files in parallel, tag them with user metadata, and split into chunks."""
+        if len(file_paths) > 1:
+            # PyMuPDF parses outside the GIL, so multi-file uploads load concurrently
+            with ThreadPoolExecutor(max_workers=min(LOAD_CONCURRENCY, len(file_paths))) as pool:
+                loaded = list(pool.map(lambda path: self._load_one(path, user_id), file_paths))
+        else:
+            loaded = [self._load_one(path, user_id) for path in file_paths]
+        documents = list(itertools.chain.from_iterable(loaded))
+        
+        if not documents:
+            return []
+        
+        chunks = self.text_splitter.split_documents(documents)
+        logger.info("Created %d chunks from %d documents", len(chunks), len(documents))
+        return chunks
+    
+    def _new_files(self, file_paths: List[str], user_id: str) -> List[tuple]:
+        """Returns (path, content hash) for the files whose contents aren't yet in the user's namespace."""
+        hashed = []
+        for path in file_paths:
+            try:
+                hashed.append((path, _file_hash(path)))
+            except OSError:
+                hashed.append((path, None))  # _load_chunks reports unreadable files
+        seen = db_manager.get_ingested_hashes(user_id, [h for _, h in hashed if h])
+        new_files = []
+        for path, file_hash in hashed:
+            if file_hash not in seen:
+                new_files.append((path, file_hash))
+                if file_hash:
+                    seen.add(file_hash)
+        return new_files
+    
     def ingest_documents(self, file_paths: List[str], user_id: str = "default") -> bool:
         """Ingest and index PDF and PowerPoint documents with user namespace."""
         user_id = str(user_id)
         if not file_paths:
             return False
         
-        documents = []
-        for path in file_paths:
-            if not os.path.exists(path):
-                print(f"File not found: {path}")
-                continue
-            
-            ext = os.path.splitext(path)[1].lower()
-            if ext not in SUPPORTED_EXTENSIONS:
-                print(f"Unsupported file type: {ext}. Supported: {SUPPORTED_EXTENSIONS}")
-                continue
-            
-            loader = self._get_loader(path)
-            if loader:
-                try:
-                    docs = loader.load()
-                    # Add source and user metadata
-                    for doc in docs:
-                        doc.metadata["source_file"] = os.path.basename(path)
-                        doc.metadata["user_id"] = user_id
-                        doc.metadata["file_type"] = ext.replace('.', '')
-                    documents.extend(docs)
-                    print(f"Successfully loaded: {path} ({len(docs)} pages/slides)")
-                except Exception as e:
-                    print(f"Error loading {path}: {e}")
+        # Re-attaching a document the user already ingested is a no-op
+        new_files = self._new_files(file_paths, user_id)
+        if not new_files:
+            return True
         
-        if not documents:
+        # Embed and upsert one batch at a time so peak memory stays at a batch, not the whole upload
+        total = 0
+        for chunks in self._iter_chunk_batches([path for path, _ in new_files], user_id):
+            _, vectors = self._embed_chunks(chunks)
+            self._upsert_chunks(chunks, vectors, user_id)
+            total += len(chunks)
+        if not total:
             return False
+        logger.info("Ingested %d chunks from %d files", total, len(new_files))
+        db_manager.record_ingested_documents(user_id, [(h, path) for path, h in new_files if h])
+        return True
+    
+    def _embed_chunks(self, chunks: List[Document], query: Optional[str] = None) -> tuple:
+        """
+        Returns (query vector or None, chunk vectors). Chunks seen before come from the on-disk
+        embedding cache; the query and the remaining chunks are embedded in one batched call.
+        """
+        texts = [c.page_content for c in chunks]
+        vectors = self.embed_cache.get_many(texts)
+        misses = [i for i, v in enumerate(vectors) if v is None]
+        head = [query] if query is not None else []
+        if not misses and not head:
+            return None, vectors
+        fresh = embeddings.embed_documents(head + [texts[i] for i in misses])
+        query_vector = fresh[0] if head else None
+        fresh = fresh[len(head):]
+        if misses:
+            self.embed_cache.put_many([texts[i] for i in misses], fresh)
+            for i, vector in zip(misses, fresh):
+                vectors[i] = vector
+        return query_vector, vectors
+    
+    def _upsert_chunks(self, chunks: List[Document], vectors: List[List[float]], user_id: str):
+        """Upserts embedded chunks into the user's namespace in concurrent batches."""
+        records = [
+            (str(uuid.uuid4()), vector, {**chunk.metadata, "text": chunk.page_content})
+            for chunk, vector in zip(chunks, vectors)
+        ]
+        batches = [records[start:start + UPSERT_BATCH_SIZE] for start in range(0, len(records), UPSERT_BATCH_SIZE)]
+        if self.upsert_index is not None:
+            # All batches in flight on the gRPC channel at once; result() surfaces the first failure
+            futures = [self.upsert_index.upsert(vectors=batch, namespace=user_id, async_req=True) for batch in batches]
+            for future in futures:
+                future.result()
+        else:
+            with ThreadPoolExecutor(max_workers=min(UPSERT_CONCURRENCY, len(batches))) as pool:
+                # list() surfaces the first failed batch as an exception
+                list(pool.map(lambda batch: self.index.upsert(vectors=batch, namespace=user_id), batches))
+        self.retrieval_cache.invalidate(user_id)
+    
+    def ingest_and_retrieve(self, file_paths: List[str], query: str, user_id: str = "default", k: int = 5) -> List[tuple]:
+        """
+        Ingest documents and retrieve for a query using a single embedding batch.
+        The query is embedded together with the new chunks instead of in a separate call.
+        """
+        user_id = str(user_id)
+        new_files = self._new_files(file_paths, user_id) if file_paths else []
+        chunks = self._load_chunks([path for path, _ in new_files], user_id) if new_files else []
         
-        chunks = self.text_splitter.split_documents(documents)
-        print(f"Created {len(chunks)} chunks from {len(documents)} documents")
+        query_vector, chunk_vectors = self._embed_chunks(chunks, query=query)
         
-        # Add to Pinecone with user namespace
-        self.vector_store.add_documents(chunks, namespace=user_id)
-        return True
+        if chunks:
+            self._upsert_chunks(chunks, chunk_vectors, user_id)
+            db_manager.record_ingested_documents(user_id, [(h, path) for path, h in new_files if h])
+        
+        return self.vector_store.similarity_search_by_vector_with_score(
+            query_vector,
+            k=k,
+            namespace=user_id
+        )
     
     def retrieve(self, query: str, user_id: str = "default", k: int = 5) -> List[tuple]:
         """Retrieve relevant chunks with scores from user's namespace."""
@@ -188,13 +388,33 @@ class VectorStoreManager:
         if not self.vector_store:
             return []
         
-        results = self.vector_store.similarity_search_with_score(
-            query, 
+        cached = self.retrieval_cache.lookup_exact(user_id, query, k)
+        if cached is not None:
+            return cached
+        # Embed once: the vector serves both the semantic cache check and the search itself
+        vec = unit_embedding(query)
+        cached = self.retrieval_cache.lookup_similar(user_id, query, vec, k)
+        if cached is not None:
+            return cached
+        
+        results = self.vector_store.similarity_search_by_vector_with_score(
+            vec.tolist(),
             k=k,
             namespace=user_id
         )
+        self.retrieval_cache.store(user_id, query, k, vec, results)
         return results
     
+    async def aretrieve(self, query: str, user_id: str = "default", k: int = 5) -> List[tuple]:
+        """Async retrieve(): exact cache hits return inline, misses embed and search off the event loop."""
+        user_id = str(user_id)
+        if not self.vector_store:
+            return []
+        cached = self.retrieval_cache.lookup_exact(user_id, query, k)
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self.retrieve, query, user_id, k)
+    
     def get_retriever(self, user_id: str = "default", k: int = 4):
         """Get retriever for chain usage."""
         if not self.vector_store:
@@ -207,11 +427,12 @@ class VectorStoreManager:
     def delete_user_data(self, user_id: str) -> bool:
         """Delete all vectors for a specific user."""
         try:
-            index = self.pc.Index(self.index_name)
-            index.delete(delete_all=True, namespace=user_id)
+            self.index.delete(delete_all=True, namespace=user_id)
+            self.retrieval_cache.invalidate(str(user_id))
+            db_manager.forget_ingested_documents(str(user_id))
             return True
         except Exception as e:
-            print(f"Error deleting user data: {e}")
+            logger.warning("Error deleting user data for %s: %s", user_id, e)
             return False
     
     def get_supported_extensions(self) -> set:
@@ -0,0 +1,121 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+import numpy as np
+from llm_config import get_embeddings
+
+# Tokens that change a query's answer while barely moving its embedding: numbers (dates, course codes),
+# weekdays, months and relative-time words. "Monday" vs "Tuesday" or "CS101" vs "CS102" score above any
+# useful similarity threshold, so queries carrying them are only ever answered by an exact repeat.
+_SPECIFIC_RE = re.compile(
+    r"\d"
+    r"|\b(?:mon|tues?|wed(?:nes)?|thu(?:rs?)?|fri|sat(?:ur)?|sun)(?:day)?s?\b"
+    r"|\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b"
+    r"|\b(?:today|tonight|tomorrow|yesterday|weekend|week|month|year|morning|afternoon|evening"
+    r"|next|last|previous|coming)\b",
+    re.IGNORECASE
+)
+
+
+def normalize_query(query: str) -> str:
+    return query.strip().lower()
+
+
+def needs_exact_match(query: str) -> bool:
+    """True when the query names a date, weekday, number or relative day, so only an exact repeat may reuse it."""
+    return _SPECIFIC_RE.search(query) is not None
+
+
+def unit_embedding(text: str) -> np.ndarray:
+    """The shared embedding model's vector for text, scaled to unit length so dot products are cosines."""
+    vec = np.asarray(get_embeddings().embed_query(text), dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class SemanticLRU:
+    """
+    Thread-safe LRU of key -> (unit vector or None, value, stored_at), with an optional TTL.
+    Entries are found by exact key, or by the nearest stored vector scoring at least threshold.
+    Entries stored without a vector are exact-only and never answer a different key.
+    """
+
+    def __init__(self, max_size: int, threshold: float, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _live(self, stored_at: float, now: float) -> bool:
+        return self.ttl is None or now - stored_at <= self.ttl
+
+    def get(self, key):
+        """Value stored under key, or None. Hits are counted here; misses are counted by nearest()."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self._live(entry[2], now):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def nearest(self, vec: Optional[np.ndarray], where: Optional[Callable] = None):
+        """Value of the closest live entry (among keys passing where) scoring >= threshold, or None; vec=None is a miss."""
+        now = time.monotonic()
+        with self._lock:
+            if vec is not None:
+                keys = [
+                    k for k, (v, _, stored_at) in self._entries.items()
+                    if v is not None and self._live(stored_at, now) and (where is None or where(k))
+                ]
+                if keys:
+                    scores = np.stack([self._entries[k][0] for k in keys]) @ vec
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        self._entries.move_to_end(keys[best])
+                        self.hits += 1
+                        return self._entries[keys[best]][1]
+            self.misses += 1
+            return None
+
+    def put(self, key, vec: Optional[np.ndarray], value):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (vec, value, now)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size and self.ttl is not None:
+                # Drop expired entries first, then the least recently used
+                for k in [k for k, e in self._entries.items() if not self._live(e[2], now)]:
+                    del self._entries[k]
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, where: Callable):
+        """Removes every entry whose key passes where."""
+        with self._lock:
+            for k in [k for k in self._entries if where(k)]:
+                del self._entries[k]
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0
+            }
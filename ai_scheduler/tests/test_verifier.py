@@ -0,0 +1,34 @@
+import datetime
+from agents.verifier import _validate
+
+
+def _at(hour: int, minute: int = 0) -> str:
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(tomorrow, datetime.time(hour, minute)).isoformat()
+
+
+def _event(title: str, start: str, end: str) -> dict:
+    return {"title": title, "start_datetime": start, "end_datetime": end}
+
+
+def test_existing_event_blocks_proposals_after_the_one_it_rejects():
+    # P1 overlaps E's start; P2 sits entirely inside E and must be rejected too
+    p1 = _event("P1", _at(8), _at(9, 30))
+    p2 = _event("P2", _at(10), _at(11))
+    existing = [{"id": 1, **_event("E", _at(9), _at(12))}]
+
+    result = _validate([p1, p2], [], existing)
+
+    assert result["approved_events"] == []
+    assert [r["event"]["title"] for r in result["rejected_events"]] == ["P1", "P2"]
+    assert len(result["conflicts"]) == 2
+
+
+def test_non_overlapping_proposal_is_approved():
+    p1 = _event("P1", _at(13), _at(14))
+    existing = [{"id": 1, **_event("E", _at(9), _at(12))}]
+
+    result = _validate([p1], [], existing)
+
+    assert [e["title"] for e in result["approved_events"]] == ["P1"]
+    assert result["is_valid"]
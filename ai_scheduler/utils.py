@@ -1,7 +1,16 @@
+import os
+import errno
 import datetime
 from typing import List
-from langchain_core.tools import tool
-from models import ScheduleEvent
+from langchain_core.tools import tool, StructuredTool
+from models import ScheduleEvent, EVENT_PRIORITIES
+from database import db_manager
+
+_PRIORITY_BY_LOWER = {p.lower(): p for p in EVENT_PRIORITIES}
+
+def _normalize_priority(priority) -> str:
+    """Canonical event priority for LLM-supplied values ("high" -> "High"); anything unknown becomes Medium."""
+    return _PRIORITY_BY_LOWER.get(str(priority).strip().lower(), "Medium")
 
 
 def get_calendar_service():
@@ -17,6 +26,46 @@ def create_calendar_event(event: ScheduleEvent) -> dict:
     return {"success": False, "error": "Google Calendar API disabled."}
 
 
+COPY_CHUNK_SIZE = 1024 * 1024
+_SENDFILE_UNSUPPORTED = {errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP}
+
+def fast_copy(src, dst_path: str) -> int:
+    """
+    Copies a file (a path, or a binary file object from its current position) to dst_path.
+    In-memory spooled uploads go out in a single write; real files use zero-copy os.sendfile
+    where the platform allows it, otherwise 1 MiB read/write chunks.
+    Returns the number of bytes copied.
+    """
+    fsrc = open(src, "rb") if isinstance(src, (str, os.PathLike)) else src
+    try:
+        with open(dst_path, "wb") as fdst:
+            if getattr(fsrc, "_rolled", True) is False:
+                # In-memory SpooledTemporaryFile: fileno() would force a rollover to disk, so write it in one call
+                data = fsrc.read()
+                fdst.write(data)
+                return len(data)
+            offset = fsrc.tell()
+            copied = 0
+            try:
+                in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+                while sent := os.sendfile(out_fd, in_fd, offset + copied, COPY_CHUNK_SIZE * 8):
+                    copied += sent
+                fsrc.seek(offset + copied)
+                return copied
+            except (AttributeError, OSError) as e:
+                # No sendfile for this platform or file pair; anything else is a real I/O error
+                if copied or (isinstance(e, OSError) and e.errno is not None and e.errno not in _SENDFILE_UNSUPPORTED):
+                    raise
+            fsrc.seek(offset)
+            while chunk := fsrc.read(COPY_CHUNK_SIZE):
+                fdst.write(chunk)
+                copied += len(chunk)
+            return copied
+    finally:
+        if fsrc is not src:
+            fsrc.close()
+
+
 @tool
 def get_current_date() -> str:
     """Returns the current date in YYYY-MM-DD format. Useful for resolving relative dates like 'tomorrow'."""
@@ -26,7 +75,6 @@ def get_current_date() -> str:
 @tool
 def list_calendar_events(limit: int = 10, user_id: int = 1) -> str:
     """Lists the next few upcoming calendar events to get an overview of the schedule."""
-    from database import db_manager
     events = db_manager.get_upcoming_events(user_id=user_id, limit=limit)
     if not events: return "No upcoming events found."
     return "\n".join([f"ID: {e['id']} | {e['title']} | {e['start_datetime']} to {e['end_datetime']}" for e in events])
@@ -38,7 +86,6 @@ def search_calendar(query: str = None, date: str = None, user_id: int = 1) -> st
     Search for specific events in the calendar.
     Provide a 'query' (keyword) to search by title/desc, or a 'date' (YYYY-MM-DD) to see events on a specific day.
     """
-    from database import db_manager
     events = db_manager.search_events(user_id=user_id, query=query, date=date)
     if not events: return f"No events found for query='{query}' date='{date}'"
     return "\n".join([f"ID: {e['id']} | {e['title']} | {e['start_datetime']} to {e['end_datetime']}" for e in events])
@@ -53,13 +100,12 @@ def add_event(title: str, start_datetime: str, end_datetime: str, priority: str
     - priority: High, Medium, or Low
     - category: Event category
     """
-    from database import db_manager
-    from models import ScheduleEvent
-    event = ScheduleEvent(
+    # Arguments are already checked against the tool schema; only priority is free-form
+    event = ScheduleEvent.model_construct(
         title=title,
         start_datetime=start_datetime,
         end_datetime=end_datetime,
-        priority=priority,
+        priority=_normalize_priority(priority),
         category=category,
         description=description,
         source="agent"
@@ -69,10 +115,38 @@ def add_event(title: str, start_datetime: str, end_datetime: str, priority: str
         return f"Skipped: Event '{title}' at {start_datetime} is already in the calendar."
     return f"Successfully added event: {title}"
 
+def bulk_add_events(events: List[dict], user_id: int = 1) -> List[str]:
+    """
+    Bulk counterpart of the add_event tool: inserts many events in one transaction.
+    Each dict takes add_event's arguments; returns one add_event-style message per event.
+    """
+    results = [None] * len(events)
+    valid = []
+    for i, args in enumerate(events):
+        try:
+            valid.append((i, ScheduleEvent(
+                title=args["title"],
+                start_datetime=args["start_datetime"],
+                end_datetime=args["end_datetime"],
+                priority=_normalize_priority(args.get("priority", "Medium")),
+                category=args.get("category", "General"),
+                description=args.get("description", ""),
+                source="agent"
+            )))
+        except Exception as e:
+            results[i] = f"Failed to add event '{args.get('title')}': {e}"
+    
+    added = db_manager.add_schedule_events([event for _, event in valid], user_id=user_id)
+    for (i, event), was_added in zip(valid, added):
+        if was_added:
+            results[i] = f"Successfully added event: {event.title}"
+        else:
+            results[i] = f"Skipped: Event '{event.title}' at {event.start_datetime} is already in the calendar."
+    return results
+
 @tool
 def delete_calendar_event(event_id: int, user_id: int = 1) -> str:
     """Deletes a specific event from the calendar by its ID."""
-    from database import db_manager
     success = db_manager.delete_event(event_id, user_id=user_id)
     if success:
         return f"Successfully deleted event with ID: {event_id}"
@@ -81,7 +155,6 @@ def delete_calendar_event(event_id: int, user_id: int = 1) -> str:
 @tool
 def delete_events_on_date(date_str: str, user_id: int = 1) -> str:
     """Deletes all events scheduled for a specific date (YYYY-MM-DD)."""
-    from database import db_manager
     count = db_manager.delete_events_by_date(date_str, user_id=user_id)
     return f"Successfully deleted {count} events on {date_str}"
 
@@ -92,7 +165,6 @@ def update_calendar_event(event_id: int, updates: dict, user_id: int = 1) -> str
     - event_id: ID of the event to update
     - updates: Dictionary of fields to update (title, start_datetime, end_datetime, priority, category, description)
     """
-    from database import db_manager
     success = db_manager.update_event(event_id, user_id=user_id, updates=updates)
     if success:
         return f"Successfully updated event with ID: {event_id}"
@@ -101,7 +173,6 @@ def update_calendar_event(event_id: int, updates: dict, user_id: int = 1) -> str
 @tool
 def clear_full_calendar(user_id: int = 1) -> str:
     """Wipes the entire calendar database. Use with extreme caution when the user wants to delete EVERYTHING."""
-    from database import db_manager
     count = db_manager.clear_all_events(user_id=user_id)
     return f"Successfully wiped the calendar. {count} events were removed."
 
@@ -109,7 +180,6 @@ def clear_full_calendar(user_id: int = 1) -> str:
 @tool
 def list_available_courses() -> str:
     """Lists all courses available in the university catalog for enrollment."""
-    from database import db_manager
     courses = db_manager.get_all_courses()
     if not courses: return "No courses found in the catalog."
     return "\n".join([f"ID: {c['id']} | {c['name']} ({c['code']}) | Credits: {c['credits']} | Semester: {c.get('semester', 'N/A')}" for c in courses])
@@ -123,36 +193,17 @@ def enroll_student_in_course(course_id: int = None, course_name: str = None) ->
     - course_name: The name of the course (will look up the ID from catalog).
     You must provide either course_id OR course_name.
     """
-    from database import db_manager
-    
     # If only course_name provided, look up the ID from catalog
     if course_id is None and course_name:
-        all_courses = db_manager.get_all_courses()
-        for c in all_courses:
-            if course_name.lower() in c['name'].lower() or course_name.lower() in c.get('code', '').lower():
-                course_id = c['id']
-                break
+        course_id = db_manager.find_course_id(course_name)
         if course_id is None:
             return f"Could not find a course matching '{course_name}' in the catalog."
     
-    
     if course_id is None:
         return "Please provide either a course_id or course_name to enroll."
         
     # Verify course_id exists in catalog
-    all_courses = db_manager.get_all_courses()
-    # If we didn't just fetch them for name lookup:
-    if not (course_id is None and course_name): 
-        # (Optimize: we could cache or reload, but for safety let's check)
-        # Actually all_courses is local scope, so if we fetched it above, we have it. 
-        # But if we entered with course_id, we didn't fetch it.
-        pass
-        
-    # Re-fetch or reuse
-    if 'all_courses' not in locals():
-        all_courses = db_manager.get_all_courses()
-        
-    course_match = next((c for c in all_courses if c['id'] == course_id), None)
+    course_match = db_manager.get_course(course_id)
     if not course_match:
         return f"Error: Course ID {course_id} not found in the catalog. Please use 'list_available_courses' to verify IDs."
     
@@ -172,14 +223,13 @@ def unenroll_student_from_course(course_id: int = None, course_name: str = None)
     - course_name: The name of the course (will look up the ID).
     You must provide either course_id OR course_name.
     """
-    from database import db_manager
-    import sqlite3
     
     # If only course_name provided, look up the ID
     if course_id is None and course_name:
         courses = db_manager.get_enrolled_courses(user_id=1)
+        needle = course_name.lower()
         for c in courses:
-            if course_name.lower() in c['name'].lower() or course_name.lower() in c['code'].lower():
+            if needle in c['name'].lower() or needle in c['code'].lower():
                 course_id = c['id']
                 break
         if course_id is None:
@@ -199,7 +249,6 @@ def unenroll_student_from_course(course_id: int = None, course_name: str = None)
 @tool
 def get_my_enrolled_courses() -> str:
     """Returns the list of courses the student is currently enrolled in with their status and grades."""
-    from database import db_manager
     courses = db_manager.get_enrolled_courses(user_id=1)
     if not courses:
         return "You are not enrolled in any courses."
@@ -212,23 +261,44 @@ def get_my_enrolled_courses() -> str:
     return "\n".join(result)
 
 
-@tool
-def retrieve_from_docs(query: str, user_id: int = 1) -> str:
+_vector_manager = None
+
+def _get_vector_manager():
+    """rag_engine imports llm_config, which imports this module, so the vector store is resolved on first use."""
+    global _vector_manager
+    if _vector_manager is None:
+        from rag_engine import vector_manager
+        _vector_manager = vector_manager
+    return _vector_manager
+
+def _format_doc_snippets(results: list) -> str:
+    if not results:
+        return "No relevant information found in the documents."
+    return "\n\n---\n\n".join(
+        f"[Source: {doc.metadata.get('source_file', 'unknown')}]\n{doc.page_content}"
+        for doc, score in results
+    )
+
+def _retrieve_from_docs(query: str, user_id: int = 1) -> str:
     """
     Searches uploaded academic documents (PDFs, PPTs) for relevant information.
     Use this tool when you need to answer questions based on the content of user-uploaded files.
     """
-    from rag_engine import vector_manager
     try:
         # Enforce string user_id for consistency
-        results = vector_manager.retrieve(query, user_id=str(user_id), k=5)
-        if not results:
-            return "No relevant information found in the documents."
-        
-        snippets = []
-        for doc, score in results:
-            snippets.append(f"[Source: {doc.metadata.get('source_file', 'unknown')}]\n{doc.page_content}")
-        
-        return "\n\n---\n\n".join(snippets)
+        return _format_doc_snippets(_get_vector_manager().retrieve(query, user_id=str(user_id), k=5))
     except Exception as e:
         return f"Error retrieving documents: {str(e)}"
+
+async def _aretrieve_from_docs(query: str, user_id: int = 1) -> str:
+    try:
+        return _format_doc_snippets(await _get_vector_manager().aretrieve(query, user_id=str(user_id), k=5))
+    except Exception as e:
+        return f"Error retrieving documents: {str(e)}"
+
+# Sync and native async implementations, so ainvoke() callers don't go through LangChain's executor hop
+retrieve_from_docs = StructuredTool.from_function(
+    func=_retrieve_from_docs,
+    coroutine=_aretrieve_from_docs,
+    name="retrieve_from_docs"
+)